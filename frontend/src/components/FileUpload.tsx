@@ -8,7 +8,7 @@ import { useNavigate } from 'react-router-dom';
 
 const FileUpload = () => {
   const [selectedFile, setSelectedFile] = useState<File | null>(null);
-  const { processFile, processingStatus, processingProgress, checkTaskStatus } = useStudyStore();
+  const { processFile, processingStatus, processingProgress, checkTaskStatus, watchTask } = useStudyStore();
   const [polling, setPolling] = useState(false);
   const navigate = useNavigate();
 
@@ -51,6 +51,20 @@ const FileUpload = () => {
         toast.info('Processing started. This may take a few moments...');
         
         setPolling(true);
+
+        // Progress is pushed by the server, polling is only a fallback
+        const streamedStatus = await watchTask(taskId);
+        if (streamedStatus) {
+          setPolling(false);
+          if (streamedStatus.status === 'Success') {
+            toast.success('File processed successfully!');
+            navigate(`/result/${file_id}`);
+          } else {
+            toast.error('Failed to process file');
+          }
+          return;
+        }
+
         const pollInterval = setInterval(async () => {
           const status = await checkTaskStatus(taskId);
           
@@ -7,7 +7,7 @@ import { motion } from 'framer-motion';
 
 
 const Sidebar = () => {
-  const { recentResults, fetchRecentResults, currentStreak } = useStudyStore();
+  const { recentResults, recentResultsTotal, fetchRecentResults, currentStreak } = useStudyStore();
   const { logout, user } = useAuthStore();
   const navigate = useNavigate();
   const location = useLocation();
@@ -61,7 +61,7 @@ const Sidebar = () => {
           </div>
           <div>
             <p className="text-xs text-gray-500">Documents</p>
-            <p className="font-medium">{Object.keys(recentResults).length}</p>
+            <p className="font-medium">{recentResultsTotal}</p>
           </div>
         </motion.div>
         
@@ -91,7 +91,7 @@ const Sidebar = () => {
           </div>
           <div>
             <p className="text-xs text-gray-500">Reward Level</p>
-            <p className="font-medium">{getRewardLevel(Object.keys(recentResults).length)}</p>
+            <p className="font-medium">{getRewardLevel(recentResultsTotal)}</p>
           </div>
         </motion.div>
       </div>
@@ -100,48 +100,31 @@ const Sidebar = () => {
       <div className="flex-1 overflow-y-auto p-4">
         <h4 className="font-medium text-sm text-gray-500 mb-3">Recent Materials</h4>
         
-        {Object.keys(recentResults).length > 0 ? (
+        {recentResults.length > 0 ? (
           <div className="space-y-2">
-          {Object.entries(recentResults)
+          {recentResults
             .slice(0, 5)
-            .map(([filename, rawData], index) => {
-              let cleanData = rawData;
-        
-              // Remove ```json and ``` if present
-              if (cleanData.startsWith("```json")) {
-                cleanData = cleanData.replace(/^```json/, "").replace(/```$/, "").trim();
-              }
-        
-              let item;
-              try {
-                item = JSON.parse(cleanData);
-              } catch (e) {
-                console.error(`Failed to parse JSON for file ${filename}`, e);
-                return null; // Skip this item
-              }
-        
-              return (
-                <motion.div
-                  key={filename}
-                  className="p-3 bg-gray-50 rounded-lg cursor-pointer hover:bg-gray-100 transition-colors"
-                  onClick={() => navigate(`/result/${filename}`)}
-                  initial={{ opacity: 0, y: 10 }}
-                  animate={{ opacity: 1, y: 0 }}
-                  transition={{ delay: 0.1 * index }}
-                >
-                  <p className="text-sm font-medium truncate">{filename}</p>
-                  {item.task_id ? (
-                    <span className="text-xs bg-yellow-100 text-yellow-800 px-2 py-0.5 rounded-full">
-                      Processing
-                    </span>
-                  ) : (
-                    <span className="text-xs bg-green-100 text-green-800 px-2 py-0.5 rounded-full">
-                      Completed
-                    </span>
-                  )}
-                </motion.div>
-              );
-            })}
+            .map((item, index) => (
+              <motion.div
+                key={item.file_id}
+                className="p-3 bg-gray-50 rounded-lg cursor-pointer hover:bg-gray-100 transition-colors"
+                onClick={() => navigate(`/result/${item.file_id}`)}
+                initial={{ opacity: 0, y: 10 }}
+                animate={{ opacity: 1, y: 0 }}
+                transition={{ delay: 0.1 * index }}
+              >
+                <p className="text-sm font-medium truncate">{item.file_id}</p>
+                {item.ready ? (
+                  <span className="text-xs bg-green-100 text-green-800 px-2 py-0.5 rounded-full">
+                    Completed
+                  </span>
+                ) : (
+                  <span className="text-xs bg-yellow-100 text-yellow-800 px-2 py-0.5 rounded-full">
+                    Processing
+                  </span>
+                )}
+              </motion.div>
+            ))}
         </div>        
         ) : (
           <p className="text-sm text-gray-500">No recent materials found</p>
@@ -6,9 +6,9 @@ import { useStudyStore } from '../stores/studyStore';
 import { useAuthStore } from '../stores/authStore';
 
 const Dashboard = () => {
-  const { fetchRecentResults, documentsProcessed  , recentResults } = useStudyStore();
+  const { fetchRecentResults, documentsProcessed  , recentResultsTotal } = useStudyStore();
   const { user } = useAuthStore();
-  const recentResultsLength = Object.keys(recentResults).length;
+  const recentResultsLength = recentResultsTotal;
 
   useEffect(() => {
     fetchRecentResults();
@@ -2,49 +2,42 @@ import { useEffect, useState } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import Sidebar from '../components/Sidebar';
 import ResultContent from '../components/ResultContent';
-import { useStudyStore, StudyResult } from '../stores/studyStore';
+import { useStudyStore, StudyResult, demoResults } from '../stores/studyStore';
+import { getTaskResult } from '../services/api';
 import { ChevronLeft, Loader } from 'lucide-react';
 import { motion } from 'framer-motion';
 
 const ResultPage = () => {
   const { fileId } = useParams<{ fileId: string }>();
-  const { recentResults, fetchRecentResults } = useStudyStore();
+  const { useDemo } = useStudyStore();
   const [currentResult, setCurrentResult] = useState<StudyResult | null>(null);
   const [loading, setLoading] = useState(true);
   const navigate = useNavigate();
 
+  // Only the result shown is fetched, the recent results list holds their metadata
   useEffect(() => {
-    const loadData = async () => {
+    if (!fileId) {
+      return;
+    }
+    const loadResult = async () => {
       setLoading(true);
-      await fetchRecentResults();
+      if (useDemo) {
+        setCurrentResult(demoResults.find((result) => result.filename === fileId) || null);
+        setLoading(false);
+        return;
+      }
+      try {
+        const data = await getTaskResult(fileId);
+        setCurrentResult({ filename: fileId, result: data.result });
+      } catch (e) {
+        console.error('Failed to load the result of', fileId, e);
+        setCurrentResult(null);
+      }
       setLoading(false);
     };
-    
-    loadData();
-  }, [fetchRecentResults]);
 
-  useEffect(() => {
-    if (Object.keys(recentResults).length > 0 && fileId) {
-
-      let rawData = recentResults[fileId];
-      if (rawData) {
-        // Clean up in case of wrapping ```json...``` blocks
-        if (rawData.startsWith("```json")) {
-          rawData = rawData.replace(/^```json/, "").replace(/```$/, "").trim();
-        }
-    
-        try {
-          const result = JSON.parse(rawData);
-          setCurrentResult({"result": result});
-        } catch (e) {
-          console.error('Failed to parse result JSON for', fileId, e);
-          setCurrentResult(null);
-        }
-      } else {
-        setCurrentResult(null);
-      }
-    }
-  }, [recentResults, fileId]);
+    loadResult();
+  }, [fileId, useDemo]);
 
   const handleBackClick = () => {
     navigate('/');
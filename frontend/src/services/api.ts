@@ -64,10 +64,23 @@ export const register = async (username: string, password: string) => {
   }
 };
 
-// Fetch recent results of the user
-export const getRecentResults = async () => {
+export interface RecentResult {
+  file_id: string;
+  last_accessed: number;
+  ready: boolean;
+}
+
+export interface RecentResultsPage {
+  items: RecentResult[];
+  total: number;
+  offset: number;
+  limit: number;
+}
+
+// Fetch the metadata of the recent results of the user, most recently accessed first
+export const getRecentResults = async (offset = 0, limit = 20): Promise<RecentResultsPage> => {
   try {
-    const response = await axiosInstance.get('/recent-results/');
+    const response = await axiosInstance.get('/recent-results/', { params: { offset, limit } });
     return response.data;
   } catch (error) {
     console.error('Error fetching recent results:', error);
@@ -75,6 +88,17 @@ export const getRecentResults = async () => {
   }
 };
 
+// Fetch the result of a processed file (partial while it is still processing)
+export const getTaskResult = async (fileId: string) => {
+  try {
+    const response = await axiosInstance.get('/get-task-result/', { params: { file_id: fileId } });
+    return response.data;
+  } catch (error) {
+    console.error('Error fetching task result:', error);
+    throw error;
+  }
+};
+
 // Process a file upload
 export const processMaterial = async (file: File) => {
   const formData = new FormData();
@@ -103,4 +127,51 @@ export const getTaskStatus = async (taskId: string) => {
     console.error('Error fetching task status:', error);
     throw error;
   }
-};
\ No newline at end of file
+};
+export interface TaskEvent {
+  task_id: string;
+  stage: string;
+  timestamp: number;
+  completed?: string;
+  error?: string;
+}
+
+// Stream the progress events of a task. Server-Sent Events are read through fetch
+// (EventSource cannot send the Authorization header). Resolves with the last event
+// received once the server closes the stream.
+export const streamTaskEvents = async (taskId: string, onEvent: (event: TaskEvent) => void) => {
+  const response = await fetch(`${API_URL}/task-events/${taskId}`, {
+    headers: {
+      'Authorization': `Bearer ${getAuthToken()}`,
+      'Accept': 'text/event-stream',
+    },
+  });
+  if (!response.ok || !response.body) {
+    throw new Error(`Task events unavailable: ${response.status}`);
+  }
+
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = '';
+  let lastEvent: TaskEvent | null = null;
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) {
+      return lastEvent;
+    }
+    buffer += value;
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const message = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      const data = message
+        .split('\n')
+        .filter((line) => line.startsWith('data: '))
+        .map((line) => line.slice(6))
+        .join('\n');
+      if (data) {
+        lastEvent = JSON.parse(data) as TaskEvent;
+        onEvent(lastEvent);
+      }
+    }
+  }
+};
@@ -1,5 +1,5 @@
 import { create } from 'zustand';
-import { getRecentResults, processMaterial, getTaskStatus } from '../services/api';
+import { getRecentResults, processMaterial, getTaskStatus, streamTaskEvents, RecentResult } from '../services/api';
 
 export interface StudyResult {
   filename: string;
@@ -13,7 +13,7 @@ export interface StudyResult {
 }
 
 // Demo data for testing
-const demoResults: StudyResult[] = [
+export const demoResults: StudyResult[] = [
   {
     filename: "Introduction_to_Psychology.pdf",
     result: {
@@ -84,13 +84,25 @@ const demoResults: StudyResult[] = [
   }
 ];
 
+// Progress bar value of each processing stage
+const stageProgress: Record<string, number> = {
+  queued: 10,
+  ingesting: 20,
+  explaining: 40,
+  evaluating: 60,
+  flashcards: 75,
+  summary: 90,
+  done: 100,
+};
+
 type ProcessFileResponse = {
   taskId: string;
   file_id: string;
 };
 
 interface StudyState {
-  recentResults: StudyResult[];
+  recentResults: RecentResult[];
+  recentResultsTotal: number;
   currentTaskId: string | null;
   processingStatus: 'idle' | 'pending' | 'success' | 'failure';
   processingProgress: number;
@@ -99,14 +111,23 @@ interface StudyState {
   fetchRecentResults: () => Promise<void>;
   processFile: (file: File) => Promise<ProcessFileResponse>;
   checkTaskStatus: (taskId: string) => Promise<any>;
+  watchTask: (taskId: string) => Promise<any>;
   incrementDocumentsProcessed: () => void;
   incrementStreak: () => void;
   resetStreak: () => void;
   useDemo: boolean;
 }
 
+// Demo data listed like the metadata returned by the API
+const demoRecentResults: RecentResult[] = demoResults.map((result) => ({
+  file_id: result.filename,
+  last_accessed: 0,
+  ready: !result.task_id,
+}));
+
 export const useStudyStore = create<StudyState>((set, get) => ({
   recentResults: [],
+  recentResultsTotal: 0,
   currentTaskId: null,
   processingStatus: 'idle',
   processingProgress: 0,
@@ -117,15 +138,15 @@ export const useStudyStore = create<StudyState>((set, get) => ({
   fetchRecentResults: async () => {
     try {
       if (get().useDemo) {
-        set({ recentResults: demoResults });
+        set({ recentResults: demoRecentResults, recentResultsTotal: demoRecentResults.length });
         return;
       }
-      const results = await getRecentResults();
-      set({ recentResults: results });
+      const page = await getRecentResults();
+      set({ recentResults: page.items, recentResultsTotal: page.total });
     } catch (error) {
       console.error('Error fetching recent results:', error);
       // Fallback to demo data on error
-      set({ recentResults: demoResults });
+      set({ recentResults: demoRecentResults, recentResultsTotal: demoRecentResults.length });
     }
   },
 
@@ -150,10 +171,13 @@ export const useStudyStore = create<StudyState>((set, get) => ({
           processingStatus: 'success',
           processingProgress: 100
         });
-        return 'completed';
+        return {
+          taskId: 'completed',
+          file_id: response.file_id
+        };
       }
       
-      return '';
+      return { taskId: '', file_id: '' };
     } catch (error) {
       set({ processingStatus: 'failure', processingProgress: 0 });
       console.error('Error processing file:', error);
@@ -198,6 +222,40 @@ export const useStudyStore = create<StudyState>((set, get) => ({
     }
   },
 
+  // Follow the task through its event stream, resolves to null if the stream is unavailable
+  watchTask: async (taskId) => {
+    if (get().useDemo) {
+      return { status: 'Success' };
+    }
+
+    try {
+      const lastEvent = await streamTaskEvents(taskId, (event) => {
+        if (event.stage in stageProgress) {
+          set({ processingProgress: stageProgress[event.stage] });
+        }
+      });
+
+      if (lastEvent?.stage === 'done') {
+        set({ 
+          processingStatus: 'success',
+          processingProgress: 100
+        });
+
+        await get().fetchRecentResults();
+        get().incrementDocumentsProcessed();
+        get().incrementStreak();
+        return { status: 'Success' };
+      } else if (lastEvent?.stage === 'failed') {
+        set({ processingStatus: 'failure' });
+        return { status: 'Failure', error: lastEvent.error };
+      }
+      return null;
+    } catch (error) {
+      console.error('Error streaming task events:', error);
+      return null;
+    }
+  },
+
   incrementDocumentsProcessed: () => {
     const currentCount = get().documentsProcessed;
     const newCount = currentCount + 1;
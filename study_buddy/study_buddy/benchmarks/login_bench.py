@@ -0,0 +1,69 @@
+"""
+Login throughput: bcrypt verify inline on the event loop (before) vs the bounded pool (after).
+
+Along with logins/sec, a ticker coroutine measures how late the event loop wakes it
+up, which is the latency every other request on the worker pays during a login burst.
+Run from the directory containing `src`:
+
+    python -m benchmarks.login_bench --logins 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from src.passwords import BCRYPT_ROUNDS, PasswordHashingPool, password_hasher
+
+
+async def measure_loop_lag(stop: asyncio.Event, lags: list, interval: float = 0.005):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def run_logins(verify, logins: int, concurrency: int, hashed_password: str):
+    """
+    Return (logins/sec, p99 event loop lag in ms).
+    """
+    remaining = iter(range(logins))
+    stop, lags = asyncio.Event(), []
+
+    async def client_loop():
+        for _ in remaining:
+            assert await verify("correct horse battery staple", hashed_password)
+
+    ticker = asyncio.create_task(measure_loop_lag(stop, lags))
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+    p99 = statistics.quantiles(lags, n=100)[98] if len(lags) >= 2 else max(lags, default=0)
+    return logins / elapsed, p99 * 1000
+
+
+async def main(logins: int, concurrency: int):
+    hashed_password = password_hasher.hash("correct horse battery staple")
+
+    async def inline_verify(password, hashed):
+        return password_hasher.verify(password, hashed)
+
+    # Queue large enough for the benchmark, so no login is rejected
+    pool = PasswordHashingPool(max_queue=concurrency)
+
+    async def pooled_verify(password, hashed):
+        return await pool.run(password_hasher.verify, password, hashed)
+
+    print(f"{logins} logins, concurrency {concurrency}, bcrypt rounds {BCRYPT_ROUNDS}")
+    for name, verify in (("inline (before)", inline_verify), ("pool (after)", pooled_verify)):
+        throughput, lag = await run_logins(verify, logins, concurrency, hashed_password)
+        print(f"{name:<16} {throughput:>8.1f} logins/s   p99 event loop lag {lag:>8.1f} ms")
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.logins, args.concurrency))
@@ -0,0 +1,95 @@
+"""
+Requests/sec of the activity middleware: BaseHTTPMiddleware (before) vs pure ASGI (after).
+
+The endpoints mirror `/` and `/task-status/{task_id}` without their backends, so the
+numbers isolate the middleware and token decoding overhead. Run from the directory
+containing `src`:
+
+    python -m benchmarks.middleware_bench --requests 5000 --concurrency 50
+"""
+import argparse
+import asyncio
+import time
+import httpx
+from fastapi import Depends, FastAPI, Request
+from jose import jwt
+from starlette.middleware.base import BaseHTTPMiddleware
+from src.activity import last_active_buffer
+from src.middleware import UpdateLastActiveMiddleware
+from src.security import ALGORITHM, SECRET_KEY, create_access_token, decode_token, oauth2_scheme
+
+
+class BaseHTTPActivityMiddleware(BaseHTTPMiddleware):
+    """
+    The middleware as it was before the ASGI rewrite (with the buffered activity write).
+    """
+
+    async def dispatch(self, request: Request, call_next):
+        token = request.headers.get("Authorization")
+        if token and token.startswith("Bearer "):
+            payload = jwt.decode(token.split()[-1], SECRET_KEY, algorithms=[ALGORITHM])
+            last_active_buffer.record(payload["sub"])
+        return await call_next(request)
+
+
+def build_app(pure_asgi: bool) -> FastAPI:
+    app = FastAPI()
+
+    async def current_username(request: Request, token: str = Depends(oauth2_scheme)):
+        if pure_asgi:
+            # Reuses the payload decoded by the middleware
+            return decode_token(token, request.scope.get("state"))["sub"]
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])["sub"]
+
+    @app.get("/")
+    async def root():
+        return {"message": "Welcome Buddy, I'm here to help!"}
+
+    @app.get("/task-status/{task_id}")
+    async def task_status(task_id: str, username: str = Depends(current_username)):
+        return {"status": "Pending"}
+
+    app.add_middleware(UpdateLastActiveMiddleware if pure_asgi else BaseHTTPActivityMiddleware)
+    return app
+
+
+async def measure(app: FastAPI, path: str, headers: dict, requests: int, concurrency: int) -> float:
+    """
+    Return the requests/sec sustained by `concurrency` clients sending `requests` requests in total.
+    """
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        remaining = iter(range(requests))
+
+        async def client_loop():
+            for _ in remaining:
+                response = await client.get(path, headers=headers)
+                response.raise_for_status()
+
+        # Warm up the routing and dependency caches
+        for _ in range(10):
+            await client.get(path, headers=headers)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        return requests / (time.perf_counter() - start)
+
+
+async def main(requests: int, concurrency: int):
+    token = create_access_token({"sub": "bench_user", "role": "user"})
+    headers = {"Authorization": f"Bearer {token}"}
+    apps = {"BaseHTTPMiddleware": build_app(pure_asgi=False), "pure ASGI": build_app(pure_asgi=True)}
+
+    print(f"{requests} requests, concurrency {concurrency}")
+    for path in ("/", "/task-status/bench-task"):
+        before = await measure(apps["BaseHTTPMiddleware"], path, headers, requests, concurrency)
+        after = await measure(apps["pure ASGI"], path, headers, requests, concurrency)
+        print(f"{path:<26} before {before:>9.0f} req/s   after {after:>9.0f} req/s   x{after / before:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency))
@@ -0,0 +1,234 @@
+import os
+import time
+import asyncio
+import asyncpg
+from datetime import datetime
+
+# Seconds between two flushes of the buffered `last_active` updates
+LAST_ACTIVE_FLUSH_INTERVAL = float(os.getenv("LAST_ACTIVE_FLUSH_INTERVAL", 5))
+# Minimum seconds between two recorded activities of the same user (0 disables the throttle)
+LAST_ACTIVE_THROTTLE = float(os.getenv("LAST_ACTIVE_THROTTLE", 0))
+
+
+class LastActiveBuffer:
+    """
+    Write-behind buffer for `users.last_active`.
+
+    Requests only record the latest activity time of their user in memory; the
+    buffer is written with a single UPDATE every `flush_interval` seconds and on
+    shutdown, so the DAU/WAU/MAU metrics lag by at most one interval.
+    """
+
+    def __init__(self, flush_interval: float = LAST_ACTIVE_FLUSH_INTERVAL, throttle: float = LAST_ACTIVE_THROTTLE):
+        self.flush_interval = flush_interval
+        self.throttle = throttle
+        self._pending = {}
+        self._last_recorded = {}
+
+    def record(self, username: str):
+        if self.throttle:
+            now = time.monotonic()
+            if now - self._last_recorded.get(username, float("-inf")) < self.throttle:
+                return
+            self._last_recorded[username] = now
+        self._pending[username] = datetime.utcnow()
+
+    async def flush(self, db_pool):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            async with db_pool.acquire() as conn:
+                await conn.execute(
+                    """
+                    UPDATE users AS u
+                    SET last_active = v.last_active
+                    FROM unnest($1::text[], $2::timestamp[]) AS v(username, last_active)
+                    WHERE u.username = v.username
+                      AND (u.last_active IS NULL OR u.last_active < v.last_active)
+                    """,
+                    list(pending.keys()),
+                    list(pending.values()),
+                )
+        except BaseException:
+            # Keep the activities for the next flush (also when cancelled), unless newer ones were recorded meanwhile
+            for username, last_active in pending.items():
+                self._pending.setdefault(username, last_active)
+            raise
+
+        if self.throttle:
+            expired = time.monotonic() - self.throttle
+            self._last_recorded = {username: recorded for username, recorded in self._last_recorded.items()
+                                   if recorded > expired}
+
+    async def run(self, db_pool):
+        """
+        Flush the buffer periodically until cancelled.
+        """
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush(db_pool)
+            except Exception as e:
+                print(f"Failed to flush last_active updates: {e}")
+
+
+last_active_buffer = LastActiveBuffer()
+
+
+# Seconds between two bulk writes of the buffered user_activity rows
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", 1))
+# Number of buffered rows triggering a write before the interval elapsed
+ACTIVITY_FLUSH_SIZE = int(os.getenv("ACTIVITY_FLUSH_SIZE", 500))
+# Rows added without waiting that are kept while the database is unavailable, newer ones are dropped
+ACTIVITY_MAX_PENDING = int(os.getenv("ACTIVITY_MAX_PENDING", 10000))
+# Failed writes of a row added without waiting before it is dropped
+ACTIVITY_MAX_ATTEMPTS = int(os.getenv("ACTIVITY_MAX_ATTEMPTS", 5))
+# Maintain the per-user daily token totals of `user_daily_tokens` along with the raw rows
+ACTIVITY_DAILY_ROLLUP = os.getenv("ACTIVITY_DAILY_ROLLUP", "false").lower() in ("1", "true", "yes")
+
+ACTIVITY_COLUMNS = ["task_id", "user_id", "tokens_used", "timestamp"]
+ACTIVITY_STAGING_TABLE = """
+    CREATE TEMP TABLE IF NOT EXISTS user_activity_staging (
+        task_id TEXT,
+        user_id INTEGER,
+        tokens_used INTEGER,
+        timestamp TIMESTAMP
+    ) ON COMMIT DELETE ROWS
+"""
+INSERT_ACTIVITY = """
+    INSERT INTO user_activity (task_id, user_id, tokens_used, timestamp)
+    SELECT task_id, user_id, tokens_used, timestamp FROM user_activity_staging
+    ON CONFLICT (task_id) DO NOTHING
+"""
+# Only the rows actually inserted (not the redelivered ones) are added to the totals
+INSERT_ACTIVITY_WITH_ROLLUP = """
+    WITH inserted AS (
+        INSERT INTO user_activity (task_id, user_id, tokens_used, timestamp)
+        SELECT task_id, user_id, tokens_used, timestamp FROM user_activity_staging
+        ON CONFLICT (task_id) DO NOTHING
+        RETURNING user_id, tokens_used, timestamp
+    )
+    INSERT INTO user_daily_tokens AS totals (user_id, day, tokens_used, jobs)
+    SELECT user_id, timestamp::date, SUM(tokens_used), COUNT(*) FROM inserted GROUP BY 1, 2
+    ON CONFLICT (user_id, day) DO UPDATE
+    SET tokens_used = totals.tokens_used + EXCLUDED.tokens_used,
+        jobs = totals.jobs + EXCLUDED.jobs
+"""
+# Errors caused by the content of a row (e.g. the user was deleted), retrying it cannot succeed
+REJECTED_ROW_ERRORS = (asyncpg.IntegrityConstraintViolationError, asyncpg.DataError)
+
+
+class ActivityAccumulator:
+    """
+    Write-behind buffer for the `user_activity` rows of the completed tasks.
+
+    Rows are copied into a per-connection staging table and inserted with a single
+    statement (idempotent on the task id) every `flush_interval` seconds, as soon as
+    `flush_size` rows are buffered, and on shutdown. `add` returns immediately, its
+    rows are retried by the next flushes (at most `max_attempts` times, at most
+    `max_pending` rows kept); `write` waits until its rows are written and raises if
+    the database is unavailable. When the database refuses a batch, its rows are
+    written one by one and the refused ones are logged and dropped.
+    """
+
+    def __init__(self, flush_interval: float = ACTIVITY_FLUSH_INTERVAL, flush_size: int = ACTIVITY_FLUSH_SIZE,
+                 daily_rollup: bool = ACTIVITY_DAILY_ROLLUP, max_pending: int = ACTIVITY_MAX_PENDING,
+                 max_attempts: int = ACTIVITY_MAX_ATTEMPTS):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.daily_rollup = daily_rollup
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._pending = []  # (row, future or None, failed attempts)
+        self._full = asyncio.Event()
+
+    def add(self, task_id: str, user_id: int, tokens_used: int, timestamp: datetime = None, future=None):
+        if future is None and len(self._pending) >= self.max_pending:
+            print(f"Activity buffer full, dropping the row of task {task_id}")
+            return
+        self._pending.append(((task_id, user_id, tokens_used, timestamp or datetime.now()), future, 0))
+        if len(self._pending) >= self.flush_size:
+            self._full.set()
+
+    async def write(self, rows):
+        """
+        Buffer (task_id, user_id, tokens_used, timestamp) rows and wait until they are written.
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for row in rows:
+            future = loop.create_future()
+            self.add(*row, future=future)
+            futures.append(future)
+        await asyncio.gather(*futures)
+
+    async def _insert(self, db_pool, records: list):
+        async with db_pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(ACTIVITY_STAGING_TABLE)
+                await conn.copy_records_to_table("user_activity_staging", records=records, columns=ACTIVITY_COLUMNS)
+                await conn.execute(INSERT_ACTIVITY_WITH_ROLLUP if self.daily_rollup else INSERT_ACTIVITY)
+
+    def _retry_later(self, entries: list, error: BaseException):
+        for row, future, attempts in entries:
+            if isinstance(error, asyncio.CancelledError):
+                # Interrupted, not failed: written by the next (final) flush
+                self._pending.append((row, future, attempts))
+            elif future is not None:
+                if not future.done():
+                    future.set_exception(error)
+            elif attempts + 1 < self.max_attempts:
+                self._pending.append((row, None, attempts + 1))
+            else:
+                print(f"Dropping the activity of task {row[0]} after {self.max_attempts} attempts: {error}")
+
+    @staticmethod
+    def _done(entries: list):
+        for _, future, _ in entries:
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    async def _insert_one_by_one(self, db_pool, entries: list):
+        for index, entry in enumerate(entries):
+            try:
+                await self._insert(db_pool, [entry[0]])
+            except REJECTED_ROW_ERRORS as e:
+                print(f"Dropping the activity of task {entry[0][0]}, refused by the database: {e}")
+            except BaseException as e:
+                self._retry_later(entries[index:], e)
+                raise
+            self._done([entry])
+
+    async def flush(self, db_pool):
+        self._full.clear()
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        try:
+            await self._insert(db_pool, [row for row, _, _ in pending])
+        except REJECTED_ROW_ERRORS:
+            # Isolate the refused rows, the others of the batch are written
+            await self._insert_one_by_one(db_pool, pending)
+            return
+        except BaseException as e:
+            self._retry_later(pending, e)
+            raise
+        self._done(pending)
+
+    async def run(self, db_pool):
+        """
+        Flush the buffer periodically (or once full) until cancelled.
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush(db_pool)
+            except Exception as e:
+                print(f"Failed to write user_activity rows: {e}")
+
+
+activity_accumulator = ActivityAccumulator()
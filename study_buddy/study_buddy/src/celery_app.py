@@ -1,11 +1,14 @@
 from celery import Celery
-from celery.signals import task_success, task_failure
-import requests
+from celery.signals import task_success, task_failure, task_postrun, worker_init, worker_process_shutdown
+from celery.states import READY_STATES
 import asyncio
+import threading
 from src.utils import process_file_main
+from src.redis_pool import close_redis_pool
+from src.spool import upload_spool
+from src.outbox import publish_task_result
+from src.metrics import start_worker_metrics_server, mark_worker_process_dead
 import os
-from cachetools import TTLCache
-import time
 from contextlib import contextmanager
 import agentops
 
@@ -24,109 +27,87 @@ load_dotenv()
 
 
 
-# FastAPI Backend URL from environment variable
-FASTAPI_BACKEND_URL = os.getenv("FASTAPI_BACKEND_URL", "http://localhost:8000/update-task-result")
-
 celery_app = Celery(
     "tasks",
     broker= "redis://localhost:6379/0",
     backend= "redis://localhost:6379/0",
 )
 
-@celery_app.task(autoretry_for=(Exception,) , max_retries=5)
-def process_file_task(file_path , user_id , file_id):
+@worker_init.connect
+def on_worker_init(**kwargs):
+    """
+    Expose the crew timings recorded by the pool processes.
+    """
+    start_worker_metrics_server()
+
+@worker_process_shutdown.connect
+def on_worker_process_shutdown(pid=None, **kwargs):
+    close_worker_loop()
+    mark_worker_process_dead(pid)
+
+# Event loop of the worker process, kept across jobs so the pooled Redis connections and
+# the threads running the crews are reused (asyncio.run would tear them down after each job)
+_worker_runtime = threading.local()
+
+def get_worker_loop() -> asyncio.AbstractEventLoop:
+    loop = getattr(_worker_runtime, "loop", None)
+    if loop is None or loop.is_closed() or _worker_runtime.pid != os.getpid():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        _worker_runtime.loop = loop
+        _worker_runtime.pid = os.getpid()
+    return loop
+
+def close_worker_loop():
+    loop = getattr(_worker_runtime, "loop", None)
+    if loop is not None and not loop.is_closed() and _worker_runtime.pid == os.getpid():
+        loop.run_until_complete(close_redis_pool())
+        loop.run_until_complete(loop.shutdown_default_executor())
+        loop.close()
+
+@celery_app.task(bind=True , autoretry_for=(Exception,) , max_retries=5)
+def process_file_task(self , file_path , user_id , file_id):
     """
     Background task for processing a file asynchronously using asyncio.
+    Errors propagate so `autoretry_for` retries the task, resuming from the checkpointed crew tasks.
     """
-    try:
-        with agentops_session() as session:
-            # Run the async function inside the Celery task
-            result = asyncio.run(process_file_main(file_path, user_id, file_id))
-            return result
-        
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return {"error": str(e)}
+    with agentops_session() as session:
+        final_attempt = self.request.retries >= self.max_retries
+        # Run the async function on the event loop of the worker process
+        return get_worker_loop().run_until_complete(
+            process_file_main(file_path, user_id, file_id, self.request.id, final_attempt))
     
 
-# Cache for storing the token and its expiration time
-token_cache = TTLCache(maxsize=1, ttl=1800)  # Default TTL of 30 minutes
-
-def get_auth_token():
+def publish_result(task_id, result):
     """
-    Retrieve and cache the authentication token from the backend.
-    Validates token expiration based on stored metadata.
+    Hand the result to the outbox, the worker does not wait for the API.
     """
-    # Check if the token is in cache and still valid
-    if "token_data" in token_cache:
-        token_data = token_cache["token_data"]
-        if time.time() < token_data["expires_at"]:  # Token is still valid
-            return token_data["access_token"]
-
-    # Otherwise, request a new token
-    token_endpoint = "http://127.0.0.1:8000/token"
-    payload = {
-        "username": "celery_service",
-        "password": os.getenv("CELERY_SERVICE_ACCESS_PASSWORD")
-    }
     try:
-        response = requests.post(token_endpoint, data=payload, timeout=5)
-        response.raise_for_status()
-        data = response.json()
-        token = data.get("access_token")
-        expires_in = data.get("expires_in", 1800)  # Default to 30 minutes if not provided
-
-        if not token:
-            raise ValueError("No token received from the backend.")
-
-        # Store token and expiration in the cache
-        token_cache["token_data"] = {
-            "access_token": token,
-            "expires_at": time.time() + expires_in - 60  # Adjust to refresh 1 minute before expiration
-        }
-
-        return token
-    except requests.RequestException as e:
-        print(f"Failed to retrieve token: {e}")
-        return None
-
-def notify_backend(url, payload):
-    """
-    Notify the FastAPI backend with retries, including service authentication.
-    """
-    max_retries = 3
-    headers = {
-        "Authorization": f"Bearer {get_auth_token()}"
-    }
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(url, json=payload, headers=headers, timeout=5)
-            response.raise_for_status()
-            print(f"Notification sent successfully: {response.status_code}")
-            return
-            
-        except requests.RequestException as e:
-            print(f"Attempt {attempt + 1} failed: {e}")
-            if attempt == max_retries - 1:
-                print("Max retries reached. Notification failed.")
-
+        publish_task_result(task_id, result)
+    except Exception as e:
+        print(f"Failed to publish the result of task {task_id}: {e}")
 
 @task_success.connect
 def on_task_success(sender=None, result=None, **kwargs):
     """
-    Send the task result to the FastAPI backend upon successful completion.
+    Send the task result to the FastAPI backend upon successful completion (through the outbox).
     """
-    task_id = sender.request.id
-    url = f"{FASTAPI_BACKEND_URL}/{task_id}"
-    payload = {"result": result}
-    notify_backend(url, payload)
+    publish_result(sender.request.id, result)
 
 @task_failure.connect
 def on_task_failure(sender=None, exception=None, **kwargs):
     """
-    Notify the FastAPI backend of task failure.
+    Notify the FastAPI backend of task failure (through the outbox).
     """
-    task_id = sender.request.id
-    url = f"{FASTAPI_BACKEND_URL}/{task_id}"
-    payload = {"result": str(exception)}
-    notify_backend(url, payload)
+    publish_result(sender.request.id, {"error": str(exception)})
+
+@task_postrun.connect(sender=process_file_task)
+def on_task_postrun(sender=None, task_id=None, kwargs=None, state=None, **extra):
+    """
+    Release the spooled upload once the task reached a terminal state (not on retries).
+    """
+    if state in READY_STATES and kwargs and kwargs.get("file_id"):
+        try:
+            upload_spool.release(kwargs["file_id"])
+        except Exception as e:
+            print(f"Failed to release spooled file {kwargs['file_id']}: {e}")
@@ -1,9 +1,71 @@
+import os
+import hashlib
 import tempfile
+from pathlib import Path
 
-# Temporary directory for uploaded files
-UPLOAD_DIR = tempfile.TemporaryDirectory()
+# Spool directory for uploaded files, shared by the API and the Celery workers
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", Path(tempfile.gettempdir()) / "study_buddy_uploads"))
+UPLOAD_DIR_QUOTA = int(os.getenv("UPLOAD_DIR_QUOTA", 2 * 1024 * 1024 * 1024))  # 2 GB
+UPLOAD_REF_TTL = int(os.getenv("UPLOAD_REF_TTL", 6 * 3600))  # Reclaim files of workers that died
 
-# Cache size for storing recent results
-CACHE_SIZE = 5
+# Recent results kept per user, the least recently accessed are evicted beyond it
+CACHE_SIZE = int(os.getenv("CACHE_SIZE", 5))
+# Largest page of /recent-results/
+RECENT_RESULTS_MAX_PAGE = int(os.getenv("RECENT_RESULTS_MAX_PAGE", 50))
 processed_cache = {}
 
+
+# Version of the crew pipeline, derived from the prompts unless pinned through the environment
+def get_pipeline_version() -> str:
+    sha256 = hashlib.sha256()
+    config_dir = Path(__file__).parent / "study_buddy" / "config"
+    for config_file in sorted(config_dir.glob("*.yaml")):
+        sha256.update(config_file.read_bytes())
+    return sha256.hexdigest()[:12]
+
+PIPELINE_VERSION = os.getenv("PIPELINE_VERSION") or get_pipeline_version()
+
+# Shared (cross-user) result cache
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", 30 * 24 * 3600))  # 30 days
+INFLIGHT_TTL = int(os.getenv("INFLIGHT_TTL", 3600))  # Upper bound of a crew run
+
+# Uploads
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 10 * 1024 * 1024))  # 10 MB, as announced by the frontend
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))  # 1 MB
+
+# Crew execution: "parallel" runs the evaluation, flashcard and summary tasks concurrently
+# once the explanation is ready, "sequential" runs the five tasks one after the other
+CREW_EXECUTION_MODE = os.getenv("CREW_EXECUTION_MODE", "parallel")
+
+# PDF text extraction, cached on disk by file content
+PDF_TEXT_CACHE_DIR = os.getenv("PDF_TEXT_CACHE_DIR", str(Path(tempfile.gettempdir()) / "study_buddy_pdf_text"))
+PDF_TEXT_CACHE_MAX_BYTES = int(os.getenv("PDF_TEXT_CACHE_MAX_BYTES", 512 * 1024 * 1024))  # 512 MB, least recently used evicted
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", min(4, os.cpu_count() or 1)))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 32))  # Smaller files are parsed inline
+
+# Materials larger than the ingestion budget are split into chunks summarised
+# concurrently (map) and merged (reduce) before reaching the ingestion agent
+INGESTION_TOKEN_BUDGET = int(os.getenv("INGESTION_TOKEN_BUDGET", 12000))
+CHUNK_TOKEN_BUDGET = int(os.getenv("CHUNK_TOKEN_BUDGET", 3000))
+CHUNK_SUMMARY_WORKERS = int(os.getenv("CHUNK_SUMMARY_WORKERS", 4))
+CHUNK_SUMMARY_CACHE_DIR = os.getenv("CHUNK_SUMMARY_CACHE_DIR", str(Path(tempfile.gettempdir()) / "study_buddy_chunk_summaries"))
+CHUNK_SUMMARY_CACHE_MAX_BYTES = int(os.getenv("CHUNK_SUMMARY_CACHE_MAX_BYTES", 256 * 1024 * 1024))  # 256 MB, least recently used evicted
+
+# Retrieval over the material: passages embedded once per file content
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", str(Path(tempfile.gettempdir()) / "study_buddy_vector_index"))
+VECTOR_INDEX_MAX_BYTES = int(os.getenv("VECTOR_INDEX_MAX_BYTES", 1024 * 1024 * 1024))  # 1 GB, least recently used evicted
+EMBEDDER = os.getenv("EMBEDDER", "hashing")  # "hashing[:dim]" or "sentence-transformers:<model>"
+PASSAGE_TOKEN_BUDGET = int(os.getenv("PASSAGE_TOKEN_BUDGET", 400))
+
+# Cache of the external calls of the crew (web search, scraping, LLM completions), "redis" or "local" (in process, offline runs)
+CALL_CACHE_BACKEND = os.getenv("CALL_CACHE_BACKEND", "redis")
+CALL_CACHE_MAX_VALUE_BYTES = int(os.getenv("CALL_CACHE_MAX_VALUE_BYTES", 512 * 1024))  # Larger results are not stored
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 7 * 24 * 3600))  # 7 days
+SCRAPE_CACHE_TTL = int(os.getenv("SCRAPE_CACHE_TTL", 24 * 3600))  # 1 day
+RAW_CONTENT_MAX_CHARS = int(os.getenv("RAW_CONTENT_MAX_CHARS", 20000))  # Per page scraped or returned by Tavily
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))  # 7 days
+# Only deterministic calls are cached by default, raise it to also cache (and replay) sampled completions
+LLM_CACHE_MAX_TEMPERATURE = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", 0.0))
+
+# Outputs of the completed crew tasks, a retried or later run of the same file resumes from them
+CHECKPOINT_TTL = int(os.getenv("CHECKPOINT_TTL", 24 * 3600))
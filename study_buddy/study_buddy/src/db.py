@@ -0,0 +1,92 @@
+import os
+import time
+import asyncpg
+from dotenv import load_dotenv
+from src.metrics import db_pool_acquire_seconds, db_pool_size, db_pool_in_use_connections, db_pool_max_size
+
+# Load environment variables from .env file
+load_dotenv()
+
+# PostgreSQL connection details
+DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", 300))  # Idle timeout (seconds)
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", 10))
+# Prepared statements cached per connection, set to 0 behind pgbouncer in transaction mode
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+DB_MAX_CACHED_STATEMENT_LIFETIME = int(os.getenv("DB_MAX_CACHED_STATEMENT_LIFETIME", 300))
+
+
+class _TimedAcquire:
+    """
+    `async with pool.acquire()` context recording how long the caller waited for a connection.
+    """
+
+    def __init__(self, pool: asyncpg.Pool, timeout: float):
+        self._pool = pool
+        self._timeout = timeout
+        self._conn = None
+
+    async def __aenter__(self):
+        start = time.perf_counter()
+        self._conn = await self._pool.acquire(timeout=self._timeout)
+        db_pool_acquire_seconds.observe(time.perf_counter() - start)
+        return self._conn
+
+    async def __aexit__(self, *exc_info):
+        await self._pool.release(self._conn)
+        self._conn = None
+
+
+class InstrumentedPool:
+    """
+    Thin wrapper around an asyncpg pool timing every acquire.
+    """
+
+    def __init__(self, pool: asyncpg.Pool):
+        self._pool = pool
+
+    def acquire(self, timeout: float = DB_POOL_ACQUIRE_TIMEOUT):
+        return _TimedAcquire(self._pool, timeout)
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+
+# Pool owned by the application lifespan
+db_pool = None
+
+
+async def create_db_pool() -> InstrumentedPool:
+    """
+    Create the application-wide connection pool, called once from the lifespan.
+    """
+    global db_pool
+    pool = await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        max_cached_statement_lifetime=DB_MAX_CACHED_STATEMENT_LIFETIME,
+    )
+    db_pool_max_size.set(pool.get_max_size())
+    db_pool_size.set_function(pool.get_size)
+    db_pool_in_use_connections.set_function(lambda: pool.get_size() - pool.get_idle_size())
+    db_pool = InstrumentedPool(pool)
+    return db_pool
+
+
+async def close_db_pool():
+    global db_pool
+    if db_pool is not None:
+        await db_pool.close()
+    db_pool = None
+
+
+async def get_db_pool():
+    """
+    Dependency returning the lifespan pool (None before startup).
+    """
+    return db_pool
@@ -1,20 +1,78 @@
-import os 
-import json
-import asyncpg
 import asyncio
 from contextlib import asynccontextmanager 
 from fastapi import FastAPI
-from dotenv import load_dotenv
-from src.config import  UPLOAD_DIR 
+from src.db import create_db_pool, close_db_pool
+from src.spool import upload_spool
 from src.metrics import  run_periodic_tasks , shutdown_event  
-from src.utils import get_redis_client
+from src.activity import last_active_buffer, activity_accumulator, ACTIVITY_DAILY_ROLLUP
+from src.passwords import password_pool
+from src.progress import progress_hub
+from src.redis_pool import get_redis_client, init_redis_pool, close_redis_pool
+from src.persistence import result_persistence, create_events_index
+from src.outbox import ActivityIngester
 
 
+async def final_write(name: str, write):
+    try:
+        await write
+    except Exception as e:
+        print(f"Failed to write the buffered {name} on shutdown: {e}")
 
-# Load environment variables from .env file
-load_dotenv()
 
-DATABASE_URL = os.getenv("DATABASE_URL")
+async def create_schema(conn, daily_rollup: bool = ACTIVITY_DAILY_ROLLUP):
+    """
+    Create the tables and indexes, idempotently.
+    """
+    # Create necessary tables
+    await conn.execute(""" 
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        hashed_password TEXT NOT NULL ,
+        last_active TIMESTAMP DEFAULT NOW(), 
+        role VARCHAR(50) DEFAULT 'user'
+    )
+    """)
+    await conn.execute(""" 
+    CREATE TABLE IF NOT EXISTS events (
+        id SERIAL PRIMARY KEY,
+        filename TEXT NOT NULL,
+        result JSONB NOT NULL,
+        user_id INTEGER NOT NULL REFERENCES users(id)
+    )
+    """)
+    await conn.execute(""" 
+    CREATE TABLE IF NOT EXISTS user_activity (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        tokens_used INTEGER NOT NULL,
+        timestamp TIMESTAMP DEFAULT NOW(),
+        task_id TEXT UNIQUE,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    """)
+    # Results are upserted by (user, file), and kept by last access
+    await create_events_index(conn)
+    await conn.execute("""
+    ALTER TABLE events ADD COLUMN IF NOT EXISTS last_accessed DOUBLE PRECISION
+    """)
+    # Task results are applied idempotently by task id
+    await conn.execute("""
+    ALTER TABLE user_activity ADD COLUMN IF NOT EXISTS task_id TEXT UNIQUE
+    """)
+    if daily_rollup:
+        # Per-user daily token totals, maintained by the activity accumulator (rows written
+        # before it was enabled are not counted)
+        await conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_daily_tokens (
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            day DATE NOT NULL,
+            tokens_used BIGINT NOT NULL DEFAULT 0,
+            jobs INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        )
+        """)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -22,80 +80,44 @@ async def lifespan(app: FastAPI):
     Application lifespan context manager for initializing and cleaning up resources.
     """
 
-    db_pool = await asyncpg.create_pool(DATABASE_URL)
+    db_pool = await create_db_pool()
     async with db_pool.acquire() as conn:
-        # Create necessary tables
-        await conn.execute(""" 
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            username TEXT UNIQUE NOT NULL,
-            hashed_password TEXT NOT NULL ,
-            last_active TIMESTAMP DEFAULT NOW(), 
-            role VARCHAR(50) DEFAULT 'user'
-        )
-        """)
-        await conn.execute(""" 
-        CREATE TABLE IF NOT EXISTS events (
-            id SERIAL PRIMARY KEY,
-            filename TEXT NOT NULL,
-            result JSONB NOT NULL,
-            user_id INTEGER NOT NULL REFERENCES users(id)
-        )
-        """)
-        await conn.execute(""" 
-        CREATE TABLE IF NOT EXISTS user_activity (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER NOT NULL,
-            tokens_used INTEGER NOT NULL,
-            timestamp TIMESTAMP DEFAULT NOW(),
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        )
-        """)
+        await create_schema(conn)
 
     app.state.db_pool = db_pool
+    # Drop the uploads left behind by a previous run
+    await asyncio.to_thread(upload_spool.reclaim)
+    await init_redis_pool()
     redis_client = await get_redis_client()
+    # fanning the task progress events out to the open streams
+    progress_hub.start(redis_client)
     # scrapping metrics periodicaly
-    asyncio.create_task(run_periodic_tasks())
+    asyncio.create_task(run_periodic_tasks(db_pool))
+    # flushing the buffered last_active updates periodicaly
+    last_active_task = asyncio.create_task(last_active_buffer.run(db_pool))
+    # recording the task results published by the workers
+    ingester_task = asyncio.create_task(ActivityIngester(redis_client=redis_client).run())
+    # writing the user_activity rows in bulk
+    activity_task = asyncio.create_task(activity_accumulator.run(db_pool))
 
     # Load recent results from the database into the cache
-    async with db_pool.acquire() as conn:
-        rows = await conn.fetch("""
-        SELECT user_id, filename, result FROM events
-        """)
-        for row in rows:
-            await redis_client.hset(row["user_id"] , row["filename"] ,row["result"])
-
+    await result_persistence.warm_up(db_pool, redis_client)
+    await result_persistence.start_tracking(redis_client)
+    # syncing the results written since the last sync to the database periodicaly
+    persistence_task = asyncio.create_task(result_persistence.run(db_pool, redis_client))
     
     yield
     shutdown_event.set()
-    user_ids = await redis_client.keys("user_id:*")
-
-    async with db_pool.acquire() as conn:
-        for user_id in user_ids:
-            raw_events = await redis_client.hgetall(user_id)
-            events = []
-            for file_id, result_bytes in raw_events.items():
-                result = json.loads(result_bytes.decode())
-                id = int(user_id.decode().split(":")[1])
-                events.append({"filename": file_id, "result": result, "user_id": id})
-
-            for event in events:
-                result_json = json.dumps(event["result"])
-                await conn.execute("""
-                    INSERT INTO events (filename, result, user_id)
-                    VALUES ($1, $2, $3)
-                    ON CONFLICT (id) DO NOTHING
-                """, event["filename"].decode(), result_json, event["user_id"] )
-
-            await conn.execute("""
-                DELETE FROM events
-                WHERE user_id = $1 AND id NOT IN (
-                    SELECT id FROM events
-                    WHERE user_id = $1
-                    ORDER BY id DESC
-                    LIMIT 5
-                )
-            """, event["user_id"])
+    # Wait for the background tasks to stop, a write they were doing is put back in its buffer
+    for task in (ingester_task, activity_task, last_active_task, persistence_task):
+        task.cancel()
+    await asyncio.gather(ingester_task, activity_task, last_active_task, persistence_task, return_exceptions=True)
+    await progress_hub.stop()
+    # Only the updates since the last periodic flush (or sync) are left, one failing does not stop the others
+    await final_write("last_active updates", last_active_buffer.flush(db_pool))
+    await final_write("user_activity rows", activity_accumulator.flush(db_pool))
+    await final_write("results", result_persistence.sync(db_pool, redis_client))
 
-    await db_pool.close()
-    UPLOAD_DIR.cleanup()
\ No newline at end of file
+    await close_db_pool()
+    await close_redis_pool()
+    password_pool.shutdown()
\ No newline at end of file
@@ -1,14 +1,14 @@
+import os
 import time
 import psutil
 import asyncio
 from contextlib import suppress
 from prometheus_fastapi_instrumentator import Instrumentator
-from prometheus_client import Gauge
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, multiprocess, start_http_server
 from prometheus_fastapi_instrumentator.metrics import (
     requests,
     latency,
 )
-from src.security import get_db_pool
 
 
 # Uptime Gauge
@@ -28,11 +28,14 @@ def update_system_metrics():
     cpu_usage_gauge.set(psutil.cpu_percent())
     memory_usage_gauge.set(psutil.virtual_memory().percent)
 
+# Seconds between two collections of the periodic metrics
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", 10))
+
 # Event to monitor the background collection of metrics
 shutdown_event = asyncio.Event()
 
 # Function to collect metrics in the background
-async def run_periodic_tasks():
+async def run_periodic_tasks(db_pool):
     try:
         while not shutdown_event.is_set():
             # Update system metrics
@@ -40,8 +43,11 @@ async def run_periodic_tasks():
             track_uptime()
 
             # Update user-related metrics
-            await update_metrics()
-            await asyncio.sleep(10)
+            try:
+                await update_metrics(db_pool)
+            except Exception as e:
+                print(f"Failed to update user metrics: {e}")
+            await asyncio.sleep(METRICS_INTERVAL)
     except asyncio.CancelledError:
         # Task was cancelled during shutdown
         print("Periodic metrics task cancelled.")
@@ -56,46 +62,32 @@ dau = Gauge("daily_active_users", "Number of active users per day")
 wau = Gauge("weekly_active_users", "Number of active users per week")
 mau = Gauge("monthly_active_users", "Number of active users per month")
 
-# Helper function to get active users from PostgreSQL
-async def get_active_users(period: str):
-    query = f"""
-        SELECT COUNT(DISTINCT id)
-        FROM users
-        WHERE last_active >= CURRENT_DATE - INTERVAL '{period}' AND role = 'user';
-    """
-    db_pool = await get_db_pool()
-    async with db_pool.acquire() as conn:  
-        result = await conn.fetchval(query)
-        await conn.close()
-        return result or 0
-
-# Helper function to get the total users
-async def get_total_users():
-    query = f"""
-        SELECT COUNT(id) FROM users
-        WHERE role = 'user';
-    """
-    db_pool = await get_db_pool()
-    async with db_pool.acquire() as conn:  
-        result = await conn.fetchval(query)
-        await conn.close()
-        return result or 0
+# Counts every user-related metric in a single round trip
+USER_METRICS_QUERY = """
+    SELECT
+        COUNT(*) AS total,
+        COUNT(*) FILTER (WHERE last_active >= CURRENT_DATE - INTERVAL '1 day') AS daily,
+        COUNT(*) FILTER (WHERE last_active >= CURRENT_DATE - INTERVAL '7 days') AS weekly,
+        COUNT(*) FILTER (WHERE last_active >= CURRENT_DATE - INTERVAL '30 days') AS monthly
+    FROM users
+    WHERE role = 'user';
+"""
+
+# Helper function to get the user counts from PostgreSQL
+async def get_user_counts(db_pool):
+    async with db_pool.acquire() as conn:
+        return await conn.fetchrow(USER_METRICS_QUERY)
 
 # Function to update all metrics
-async def update_metrics():
-    # Get the count of active users for different periods
-    active_users_today = await get_active_users('1 day')
-    active_users_week = await get_active_users('7 days')
-    active_users_month = await get_active_users('30 days')
-    
-    # Update Prometheus metrics
-    active_users.set(active_users_today)
-    dau.set(active_users_today)
-    wau.set(active_users_week)
-    mau.set(active_users_month)
+async def update_metrics(db_pool):
+    counts = await get_user_counts(db_pool)
 
-    # Update the total users count 
-    total_users.set(await get_total_users())
+    # Update Prometheus metrics
+    active_users.set(counts["daily"])
+    dau.set(counts["daily"])
+    wau.set(counts["weekly"])
+    mau.set(counts["monthly"])
+    total_users.set(counts["total"])
 
 # Function to configure Prometheus instrumentator
 def configure_instrumentator():
@@ -107,3 +99,62 @@ def configure_instrumentator():
     )
     instrumentator.add(lambda _: uptime_gauge)  # Adding custom metrics
     return instrumentator
+
+
+# Redis connection pool metrics, labelled by pool ("async" for the asyncio client, "sync" for the blocking one)
+redis_pool_max_connections = Gauge("redis_pool_max_connections", "Maximum number of connections of the Redis pool",
+                                   ["pool"], multiprocess_mode="livesum")
+redis_pool_in_use_connections = Gauge("redis_pool_in_use_connections", "Number of Redis connections currently checked out",
+                                      ["pool"], multiprocess_mode="livesum")
+
+
+# PostgreSQL connection pool metrics
+db_pool_acquire_seconds = Histogram("db_pool_acquire_seconds", "Time spent waiting for a PostgreSQL connection",
+                                    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+db_pool_size = Gauge("db_pool_size", "Number of connections opened by the PostgreSQL pool")
+db_pool_in_use_connections = Gauge("db_pool_in_use_connections", "Number of PostgreSQL connections currently acquired")
+db_pool_max_size = Gauge("db_pool_max_size", "Maximum number of connections of the PostgreSQL pool")
+
+
+# Authenticated user lookups, result is "hit", "negative_hit" (known unknown user) or "miss"
+user_cache_requests = Counter("user_cache_requests_total", "User lookups served by the in-process cache", ["result"])
+
+# Password hashing pool
+password_hash_in_flight = Gauge("password_hash_in_flight", "Password hash/verify jobs running or queued")
+password_hash_rejected = Counter("password_hash_rejected_total", "Password hash/verify jobs rejected because the pool was saturated")
+
+
+# Crew runs, recorded by the Celery workers, labelled by execution mode ("sequential" or "parallel")
+crew_task_duration_seconds = Histogram("crew_task_duration_seconds", "Duration of each crew task", ["task", "mode"],
+                                       buckets=(5, 10, 20, 30, 60, 90, 120, 180, 300, 600))
+crew_job_overhead_seconds = Histogram("crew_job_overhead_seconds", "Time spent building the crews of a job before the kickoff",
+                                      ["mode"], buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+crew_run_duration_seconds = Histogram("crew_run_duration_seconds", "Wall time of a whole crew run", ["mode"],
+                                      buckets=(30, 60, 120, 180, 300, 450, 600, 900, 1200))
+
+# Port of the metrics endpoint of the Celery workers
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", 9100))
+
+def start_worker_metrics_server():
+    """
+    Expose the metrics of every worker process, aggregated through the prometheus multiprocess mode.
+    """
+    multiproc_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if not multiproc_dir:
+        print("PROMETHEUS_MULTIPROC_DIR is not set, worker metrics are not exposed.")
+        return
+
+    # The directory is created and emptied by the celery command (supervisord.conf), before
+    # any metric is built: files of this run are already there when the worker starts
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    start_http_server(WORKER_METRICS_PORT, registry=registry)
+    print(f"Worker metrics exposed on port {WORKER_METRICS_PORT}")
+
+def mark_worker_process_dead(pid: int):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
+
+
+# Cached external calls of the crew, result is "hit", "miss" or "coalesced" (waited for an identical call in flight)
+call_cache_requests = Counter("call_cache_requests_total", "Lookups of the external call cache", ["namespace", "result"])
@@ -1,41 +1,52 @@
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
-from datetime import datetime
-from jose import JWTError, jwt
-from src.security import get_db_pool, ALGORITHM, SECRET_KEY
-
-class UpdateLastActiveMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        token = request.headers.get("Authorization")
-        
-        if token and token.startswith("Bearer "):  # Check if the token is present and correctly formatted
-            token = token.split()[-1]  # Extract the actual token
-            try:
-                # Decode the token
-                payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-                username = payload.get("sub")
-                
-                if username:
-                    db_pool = await get_db_pool()
-                    # Get a connection from the asyncpg pool
-                    async with db_pool.acquire() as conn:
-                        # Update last_active field in the database
-                        await conn.execute(
-                            """
-                            UPDATE users
-                            SET last_active = $1
-                            WHERE username = $2
-                            """,
-                            datetime.utcnow(),
-                            username,
-                        )
-            except JWTError:
-                # Handle invalid token cases
-                print("Invalid or expired JWT token")
-            except Exception as e:
-                # Handle other unexpected errors
-                print(f"Error processing token: {e}")
-        
+from jose import JWTError
+from starlette.types import ASGIApp, Receive, Scope, Send
+from src.security import decode_token
+from src.activity import last_active_buffer
+
+
+def get_bearer_token(scope: Scope):
+    """
+    Extract the bearer token from the raw ASGI headers.
+    """
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            value = value.decode("latin-1")
+            if value.startswith("Bearer "):  # Check if the token is correctly formatted
+                return value.split()[-1]  # Extract the actual token
+            return None
+    return None
+
+
+class UpdateLastActiveMiddleware:
+    """
+    Pure ASGI middleware recording the activity of authenticated users.
+
+    Unlike BaseHTTPMiddleware it does not wrap the request in extra tasks nor
+    buffer the response, so streaming responses go straight through. The decoded
+    token is kept in the request state for `get_current_user` to reuse.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http":
+            token = get_bearer_token(scope)
+            if token:
+                try:
+                    # Decode the token
+                    payload = decode_token(token, scope.setdefault("state", {}))
+                    username = payload.get("sub")
+
+                    if username:
+                        # Buffered, written to the database in batches by the lifespan task
+                        last_active_buffer.record(username)
+                except JWTError:
+                    # Handle invalid token cases
+                    print("Invalid or expired JWT token")
+                except Exception as e:
+                    # Handle other unexpected errors
+                    print(f"Error processing token: {e}")
+
         # Proceed with the request
-        response = await call_next(request)
-        return response
+        await self.app(scope, receive, send)
@@ -0,0 +1,225 @@
+import os
+import json
+import socket
+import asyncio
+from abc import ABC, abstractmethod
+from datetime import datetime
+from redis.exceptions import ResponseError
+from dotenv import load_dotenv
+from src.redis_pool import get_redis_client, get_sync_redis_client, close_redis_pool
+from src.db import create_db_pool, close_db_pool
+from src.activity import activity_accumulator
+
+load_dotenv()
+
+# Task results are not posted to the API from the Celery signal handlers: the
+# handlers append them to a Redis stream (a sub-millisecond XADD) and return the
+# worker to the queue, a consumer group in the API applies them in batches.
+
+OUTBOX_STREAM = os.getenv("OUTBOX_STREAM", "outbox:task_results")
+OUTBOX_MAXLEN = int(os.getenv("OUTBOX_MAXLEN", 100000))  # Approximate cap of the stream length
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 100))
+OUTBOX_BLOCK_MS = int(os.getenv("OUTBOX_BLOCK_MS", 5000))
+OUTBOX_CLAIM_IDLE_MS = int(os.getenv("OUTBOX_CLAIM_IDLE_MS", 60000))  # Entries left pending this long are redelivered
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", 0.5))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", 60))
+# Deliveries of a malformed entry before it is moved to the dead-letter stream `{stream}:dead`
+OUTBOX_MAX_DELIVERIES = int(os.getenv("OUTBOX_MAX_DELIVERIES", 5))
+
+
+def publish_task_result(task_id: str, result: dict):
+    """
+    Append the outcome of a task to the outbox stream: the user and token usage, or the error.
+    The crew output itself is not published, it is in the shared result cache.
+    """
+    fields = {"task_id": task_id}
+    if isinstance(result, dict) and result.get("user_id"):
+        fields.update(user_id=result["user_id"], tokens_used=int(result.get("metadata") or 0))
+    else:
+        fields["error"] = str(result.get("error") if isinstance(result, dict) else result)
+    get_sync_redis_client().xadd(OUTBOX_STREAM, fields, maxlen=OUTBOX_MAXLEN, approximate=True)
+
+
+def decode_entry(entry_id, fields: dict) -> dict:
+    # Stream ids start with the time the entry was added, in milliseconds
+    timestamp = datetime.fromtimestamp(int(entry_id.decode().split("-")[0]) / 1000)
+    entry = {name.decode(): value.decode() for name, value in fields.items()}
+    if "result" in entry:
+        # Published with the whole result, before the upgrade
+        result = json.loads(entry.pop("result"))
+        if isinstance(result, dict) and result.get("user_id"):
+            entry.update(user_id=str(result["user_id"]), tokens_used=str(result.get("metadata") or 0))
+        else:
+            entry["error"] = str(result.get("error") if isinstance(result, dict) else result)
+    entry["timestamp"] = timestamp
+    return entry
+
+
+class StreamConsumer(ABC):
+    """
+    Member of a consumer group of the outbox stream, handing batches of entries to `handle`.
+
+    Each entry is first checked on its own by `parse`, a malformed entry is left out
+    of the batch. Entries are acknowledged once `handle` returns; when it raises, the
+    batch stays pending, the consumer backs off exponentially and the entries are
+    claimed again (by this consumer or another one) once they have been idle
+    `claim_idle_ms`. A malformed entry delivered `max_deliveries` times is moved to
+    the dead-letter stream and acknowledged.
+    """
+
+    def __init__(self, group: str, stream: str = OUTBOX_STREAM, consumer: str = None, redis_client=None,
+                 batch_size: int = OUTBOX_BATCH_SIZE, block_ms: int = OUTBOX_BLOCK_MS,
+                 claim_idle_ms: int = OUTBOX_CLAIM_IDLE_MS, max_deliveries: int = OUTBOX_MAX_DELIVERIES):
+        self.group = group
+        self.stream = stream
+        self.dead_letter_stream = f"{stream}:dead"
+        self.max_deliveries = max_deliveries
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self._redis_client = redis_client
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self._backoff = 0
+
+    async def redis_client(self):
+        if self._redis_client is None:
+            self._redis_client = await get_redis_client()
+        return self._redis_client
+
+    def parse(self, entry: dict):
+        """
+        Check a decoded entry and convert it for `handle`, raise if it is malformed.
+        """
+        return entry
+
+    @abstractmethod
+    async def handle(self, entries: list):
+        """
+        Process a batch of parsed entries, raise to have them delivered again.
+        """
+
+    async def ensure_group(self):
+        redis_client = await self.redis_client()
+        try:
+            await redis_client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _claim_stale(self):
+        redis_client = await self.redis_client()
+        response = await redis_client.xautoclaim(self.stream, self.group, self.consumer,
+                                                 min_idle_time=self.claim_idle_ms, start_id="0-0",
+                                                 count=self.batch_size)
+        # Entries deleted from the stream (trimmed) come back empty
+        return [(entry_id, fields) for entry_id, fields in response[1] if fields]
+
+    async def _read_new(self):
+        redis_client = await self.redis_client()
+        response = await redis_client.xreadgroup(self.group, self.consumer, {self.stream: ">"},
+                                                 count=self.batch_size, block=self.block_ms)
+        return response[0][1] if response else []
+
+    async def _dead_letter(self, malformed: list) -> int:
+        """
+        Move the malformed entries delivered `max_deliveries` times to the dead-letter stream.
+        The others stay pending and are delivered again. Returns the number of entries moved.
+        """
+        redis_client = await self.redis_client()
+        dead = []
+        for entry_id, fields, error in malformed:
+            pending = await redis_client.xpending_range(self.stream, self.group, min=entry_id, max=entry_id, count=1)
+            if pending and pending[0]["times_delivered"] < self.max_deliveries:
+                continue
+            print(f"Moving outbox entry {entry_id.decode()} to {self.dead_letter_stream}: {error}")
+            dead.append((entry_id, fields, error))
+        if dead:
+            async with redis_client.pipeline(transaction=True) as pipe:
+                for entry_id, fields, error in dead:
+                    pipe.xadd(self.dead_letter_stream, {**fields, "dead_letter_id": entry_id, "dead_letter_group": self.group,
+                                                        "dead_letter_error": str(error)},
+                              maxlen=OUTBOX_MAXLEN, approximate=True)
+                pipe.xack(self.stream, self.group, *[entry_id for entry_id, _, _ in dead])
+                await pipe.execute()
+        return len(dead)
+
+    async def consume_once(self) -> int:
+        """
+        Handle one batch, stale entries first. Returns the number of entries acknowledged.
+        """
+        batch = await self._claim_stale() or await self._read_new()
+        if not batch:
+            return 0
+        entries, entry_ids, malformed = [], [], []
+        for entry_id, fields in batch:
+            try:
+                entries.append(self.parse(decode_entry(entry_id, fields)))
+                entry_ids.append(entry_id)
+            except Exception as e:
+                malformed.append((entry_id, fields, e))
+        acknowledged = await self._dead_letter(malformed) if malformed else 0
+        if entries:
+            await self.handle(entries)
+            redis_client = await self.redis_client()
+            await redis_client.xack(self.stream, self.group, *entry_ids)
+        return acknowledged + len(entries)
+
+    async def run(self):
+        """
+        Consume the stream until cancelled.
+        """
+        await self.ensure_group()
+        while True:
+            try:
+                await self.consume_once()
+                self._backoff = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._backoff = min(OUTBOX_BACKOFF_MAX, max(OUTBOX_BACKOFF_BASE, self._backoff * 2))
+                print(f"{type(self).__name__} failed, retrying in {self._backoff:.1f}s: {e}")
+                await asyncio.sleep(self._backoff)
+
+
+class ActivityIngester(StreamConsumer):
+    """
+    Record the token usage of the completed tasks in `user_activity`.
+
+    Rows are written in bulk by the activity accumulator, keyed by task id with
+    ON CONFLICT DO NOTHING, so an entry delivered twice (at-least-once delivery) is
+    only counted once. A batch is acknowledged once its rows are written.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(group="activity_ingester", **kwargs)
+
+    def parse(self, entry: dict):
+        # The row of a successful task, None for a failed one
+        if entry.get("user_id"):
+            return entry["task_id"], int(entry["user_id"]), int(entry["tokens_used"]), entry["timestamp"]
+        print(f"Task {entry['task_id']} failed. {entry.get('error')}")
+        return None
+
+    async def handle(self, entries: list):
+        rows = [row for row in entries if row is not None]
+        if rows:
+            await activity_accumulator.write(rows)
+
+
+async def main():
+    """
+    Run the ingester as a standalone process (the API runs one in its lifespan).
+    """
+    db_pool = await create_db_pool()
+    accumulator_task = asyncio.create_task(activity_accumulator.run(db_pool))
+    try:
+        await ActivityIngester().run()
+    finally:
+        accumulator_task.cancel()
+        await activity_accumulator.flush(db_pool)
+        await close_db_pool()
+        await close_redis_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
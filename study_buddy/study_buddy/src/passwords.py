@@ -0,0 +1,62 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException, status
+from passlib.hash import bcrypt
+from src.metrics import password_hash_in_flight, password_hash_rejected
+
+# bcrypt cost factor of the new hashes (existing hashes keep their own)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+# bcrypt releases the GIL, so a thread pool hashes in parallel without blocking the event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+# Jobs allowed to wait for a worker before requests are rejected with a 503
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", 16))
+
+password_hasher = bcrypt.using(rounds=BCRYPT_ROUNDS)
+
+
+class PasswordHashingPool:
+    """
+    Bounded pool running the bcrypt hash/verify calls off the event loop.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_MAX_QUEUE):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._capacity = workers + max_queue
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    async def run(self, func, *args):
+        with self._lock:
+            if self._in_flight >= self._capacity:
+                password_hash_rejected.inc()
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    detail="Too many authentication requests, please retry",
+                                    headers={"Retry-After": "1"})
+            self._in_flight += 1
+        password_hash_in_flight.inc()
+        job = self._executor.submit(func, *args)
+        # Counted until the executor is done with the job, a cancelled request does not free its slot
+        # while its job is still queued or running (a queued job is cancelled along with the request)
+        job.add_done_callback(self._job_done)
+        return await asyncio.wrap_future(job)
+
+    def _job_done(self, job):
+        with self._lock:
+            self._in_flight -= 1
+        password_hash_in_flight.dec()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_pool = PasswordHashingPool()
+
+
+async def hash_password(password: str) -> str:
+    return await password_pool.run(password_hasher.hash, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    return await password_pool.run(password_hasher.verify, password, hashed_password)
@@ -0,0 +1,214 @@
+import os
+import json
+import asyncio
+from src.config import CACHE_SIZE, RESULT_CACHE_TTL
+from src.result_cache import (DIRTY_USERS_KEY, RECENCY_FLOOR, link_user_result, result_key, user_key, recency_key,
+                              resolve_many_user_results)
+
+# The recent results of the users live in Redis (`user_id:{id}` hashes) and are
+# persisted to the `events` table, which keeps the CACHE_SIZE latest files of
+# each user. Writing a user's results marks the user dirty, the sync only copies
+# the dirty users, periodically and on shutdown, so shutdown flushes a small
+# delta. The table warms the cache back at startup. Each row keeps the last
+# access time of its file as of the user's last sync (the score of the
+# `recent:{id}` index, NULL when unknown), the files kept and warmed up are the
+# most recently accessed.
+
+# Seconds between two syncs of the dirty users
+PERSISTENCE_SYNC_INTERVAL = float(os.getenv("PERSISTENCE_SYNC_INTERVAL", 60))
+# Users synced per round trip
+PERSISTENCE_BATCH_SIZE = int(os.getenv("PERSISTENCE_BATCH_SIZE", 200))
+# Set once the dirty set is maintained, until then a full SCAN of the user hashes is synced
+TRACKING_KEY = "persistence:tracking"
+# Advisory lock held while the (user_id, filename) index of `events` is created
+EVENTS_INDEX_LOCK = 7301
+
+EVENTS_STAGING_TABLE = """
+    CREATE TEMP TABLE IF NOT EXISTS events_staging (
+        user_id INTEGER,
+        filename TEXT,
+        result TEXT,
+        last_accessed DOUBLE PRECISION
+    ) ON COMMIT DELETE ROWS
+"""
+UPSERT_EVENTS = """
+    INSERT INTO events (user_id, filename, result, last_accessed)
+    SELECT user_id, filename, result::jsonb, last_accessed FROM events_staging
+    ON CONFLICT (user_id, filename) DO UPDATE
+    SET result = EXCLUDED.result,
+        last_accessed = COALESCE(EXCLUDED.last_accessed, events.last_accessed)
+"""
+# Most recently accessed first, the rows never accessed since the column exists by insertion
+RECENCY_ORDER = "last_accessed DESC NULLS LAST, id DESC"
+# Files evicted from the cache of the synced users
+DELETE_EVICTED_EVENTS = """
+    DELETE FROM events AS e
+    WHERE e.user_id = ANY($1::int[])
+      AND (e.user_id, e.filename) NOT IN (SELECT * FROM unnest($2::int[], $3::text[]))
+"""
+TRIM_EVENTS = f"""
+    DELETE FROM events WHERE id IN (
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY {RECENCY_ORDER}) AS position
+            FROM events WHERE user_id = ANY($1::int[])
+        ) AS ranked
+        WHERE position > $2
+    )
+"""
+
+
+async def create_events_index(conn):
+    """
+    Drop the duplicated (user_id, filename) rows written by the former shutdown sync,
+    keeping the latest, and index the pair for the upserts. Serialised across the
+    instances starting together, the rows are only scanned while the index is missing.
+    """
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", EVENTS_INDEX_LOCK)
+        if await conn.fetchval("SELECT to_regclass('events_user_filename')") is not None:
+            return
+        await conn.execute("""
+            DELETE FROM events AS older USING events AS newer
+            WHERE older.user_id = newer.user_id AND older.filename = newer.filename AND older.id < newer.id
+        """)
+        await conn.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS events_user_filename ON events (user_id, filename)
+        """)
+
+
+class ResultPersistence:
+    """
+    Sync of the per-user result hashes with the `events` table.
+    """
+
+    def __init__(self, sync_interval: float = PERSISTENCE_SYNC_INTERVAL, batch_size: int = PERSISTENCE_BATCH_SIZE,
+                 keep: int = CACHE_SIZE):
+        self.sync_interval = sync_interval
+        self.batch_size = batch_size
+        self.keep = keep
+
+    async def warm_up(self, db_pool, redis_client) -> int:
+        """
+        Load the latest results of every user into the cache, without overwriting newer entries.
+        Returns the number of results loaded.
+        """
+        async with db_pool.acquire() as conn:
+            rows = await conn.fetch(f"""
+                SELECT user_id, filename, result::text AS result, last_accessed FROM (
+                    SELECT user_id, filename, result, last_accessed,
+                           ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY {RECENCY_ORDER}) AS position
+                    FROM events
+                ) AS ranked
+                WHERE position <= $1
+            """, self.keep)
+
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for row in batch:
+                    # The file id is the hash of the file: its shared entry is restored unless recomputed since
+                    pipe.set(result_key(row["filename"]), row["result"], ex=RESULT_CACHE_TTL, nx=True)
+                    pipe.hexists(user_key(row["user_id"]), row["filename"])
+                replies = await pipe.execute()
+            for row, cached in zip(batch, replies[1::2]):
+                # Linked (or read) since the sync, kept as is
+                if cached:
+                    continue
+                accessed_at = row["last_accessed"] if row["last_accessed"] is not None else RECENCY_FLOOR
+                await link_user_result(redis_client, row["user_id"], row["filename"], accessed_at=accessed_at)
+        return len(rows)
+
+    async def mark_all_dirty(self, redis_client):
+        """
+        Mark every user having results in the cache for the next sync (SCAN, non-blocking).
+        """
+        batch = []
+        async for key in redis_client.scan_iter(match=user_key("*"), count=1000):
+            batch.append(key.decode().split(":", 1)[1])
+            if len(batch) >= self.batch_size:
+                await redis_client.sadd(DIRTY_USERS_KEY, *batch)
+                batch = []
+        if batch:
+            await redis_client.sadd(DIRTY_USERS_KEY, *batch)
+
+    async def start_tracking(self, redis_client):
+        """
+        Fall back to a full sync when the dirty set was not maintained (first run, or Redis lost it).
+        """
+        if not await redis_client.exists(TRACKING_KEY):
+            await self.mark_all_dirty(redis_client)
+            await redis_client.set(TRACKING_KEY, 1)
+
+    async def _write(self, db_pool, user_ids: list, entries_list: list, results_list: list, accesses_list: list):
+        records = [
+            (user_id, file_id, json.dumps(result), accesses.get(file_id))
+            for user_id, results, accesses in zip(user_ids, results_list, accesses_list)
+            for file_id, result in results.items()
+        ]
+        # An empty hash means the cache lost the user (not an eviction), the rows are kept
+        cached = [(user_id, file_id.decode() if isinstance(file_id, bytes) else file_id)
+                  for user_id, entries in zip(user_ids, entries_list) for file_id in entries]
+        cached_users = sorted({user_id for user_id, _ in cached})
+        async with db_pool.acquire() as conn:
+            async with conn.transaction():
+                if records:
+                    await conn.execute(EVENTS_STAGING_TABLE)
+                    await conn.copy_records_to_table("events_staging", records=records,
+                                                     columns=["user_id", "filename", "result", "last_accessed"])
+                    await conn.execute(UPSERT_EVENTS)
+                if cached_users:
+                    await conn.execute(DELETE_EVICTED_EVENTS, cached_users,
+                                       [user_id for user_id, _ in cached], [file_id for _, file_id in cached])
+                await conn.execute(TRIM_EVENTS, user_ids, self.keep)
+
+    async def sync_batch(self, db_pool, redis_client) -> int:
+        """
+        Sync a batch of dirty users. Returns the number of users synced (0 once the set is empty).
+        """
+        members = await redis_client.spop(DIRTY_USERS_KEY, self.batch_size)
+        if not members:
+            return 0
+        user_ids = [int(member) for member in members]
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for user_id in user_ids:
+                    pipe.hgetall(user_key(user_id))
+                    pipe.zrange(recency_key(user_id), 0, -1, withscores=True)
+                replies = await pipe.execute()
+            entries_list = replies[0::2]
+            # Files indexed at the floor were never accessed since the index exists, stored as unknown
+            accesses_list = [{(file_id.decode() if isinstance(file_id, bytes) else file_id): score
+                              for file_id, score in scores if score > RECENCY_FLOOR}
+                             for scores in replies[1::2]]
+            results_list = await resolve_many_user_results(redis_client, entries_list)
+            await self._write(db_pool, user_ids, entries_list, results_list, accesses_list)
+        except Exception:
+            # Synced again by the next round
+            await redis_client.sadd(DIRTY_USERS_KEY, *members)
+            raise
+        return len(user_ids)
+
+    async def sync(self, db_pool, redis_client) -> int:
+        """
+        Sync every dirty user. Returns the number of users synced.
+        """
+        synced = 0
+        while True:
+            count = await self.sync_batch(db_pool, redis_client)
+            if not count:
+                return synced
+            synced += count
+
+    async def run(self, db_pool, redis_client):
+        """
+        Sync periodically until cancelled.
+        """
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync(db_pool, redis_client)
+            except Exception as e:
+                print(f"Failed to sync the results to the database: {e}")
+
+
+result_persistence = ResultPersistence()
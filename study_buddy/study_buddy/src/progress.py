@@ -0,0 +1,144 @@
+import json
+import time
+import asyncio
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Optional
+from src.config import INFLIGHT_TTL
+
+# Stages of a processing task, in order ("retrying" is entered when an attempt failed and will be retried)
+STAGES = ("queued", "ingesting", "explaining", "evaluating", "flashcards", "summary", "retrying", "done", "failed")
+TERMINAL_STAGES = ("done", "failed")
+# Stage entered once the first n crew tasks completed. Counting completions keeps the
+# progress monotonic when the last tasks run concurrently and finish in any order.
+STAGE_AFTER_COMPLETED_TASKS = ("ingesting", "explaining", "evaluating", "flashcards", "summary")
+PROGRESS_TTL = 24 * 3600
+
+# The last event of every task is kept under `task_progress:{id}` for late readers,
+# and every event is published on `task_events:{id}`.
+CHANNEL_PREFIX = "task_events:"
+# Seconds between two keep-alive comments on an idle event stream
+HEARTBEAT_INTERVAL = 15
+# Seconds after which an event stream is closed even if its task never ended (lost or unknown task)
+EVENT_STREAM_MAX_DURATION = INFLIGHT_TTL
+
+
+def progress_key(task_id: str) -> str:
+    return f"task_progress:{task_id}"
+
+
+def progress_channel(task_id: str) -> str:
+    return f"{CHANNEL_PREFIX}{task_id}"
+
+
+async def publish_progress(redis_client, task_id: str, stage: str, **details):
+    """
+    Record the new stage of a task and notify its listeners.
+    """
+    event = json.dumps({"task_id": task_id, "stage": stage, "timestamp": time.time(), **details})
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.set(progress_key(task_id), event, ex=PROGRESS_TTL)
+        pipe.publish(progress_channel(task_id), event)
+        await pipe.execute()
+
+
+async def get_progress(redis_client, task_id: str) -> Optional[dict]:
+    event = await redis_client.get(progress_key(task_id))
+    return json.loads(event) if event else None
+
+
+class ProgressHub:
+    """
+    Fan-out of the task events to the streams open in this API process.
+
+    A single pattern subscription receives the events of every task, so a
+    thousand waiting users hold a thousand idle HTTP connections but only one
+    Redis connection.
+    """
+
+    def __init__(self):
+        self._listeners = defaultdict(set)
+        self._task = None
+
+    def start(self, redis_client):
+        self._task = asyncio.create_task(self._run(redis_client))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _run(self, redis_client):
+        while True:
+            try:
+                async with redis_client.pubsub() as pubsub:
+                    await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+                    # Events published while the subscription was down are lost, let the streams re-read
+                    for queues in self._listeners.values():
+                        for queue in queues:
+                            queue.put_nowait(None)
+                    async for message in pubsub.listen():
+                        if message["type"] != "pmessage":
+                            continue
+                        task_id = message["channel"].decode()[len(CHANNEL_PREFIX):]
+                        event = json.loads(message["data"])
+                        for queue in self._listeners.get(task_id, ()):
+                            queue.put_nowait(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Task events subscription lost, reconnecting: {e}")
+                await asyncio.sleep(1)
+
+    @asynccontextmanager
+    async def subscribe(self, task_id: str):
+        """
+        Yield a queue receiving the events of the task while the context is open,
+        and None whenever events may have been missed.
+        """
+        queue = asyncio.Queue()
+        self._listeners[task_id].add(queue)
+        try:
+            yield queue
+        finally:
+            self._listeners[task_id].discard(queue)
+            if not self._listeners[task_id]:
+                del self._listeners[task_id]
+
+
+progress_hub = ProgressHub()
+
+
+async def stream_progress(redis_client, task_id: str, hub: ProgressHub = progress_hub,
+                          heartbeat: float = HEARTBEAT_INTERVAL, max_duration: float = EVENT_STREAM_MAX_DURATION):
+    """
+    Yield the progress of a task as Server-Sent Events until it is done or failed.
+    The stage is read again on every heartbeat and resubscription, so a terminal event
+    missed by the hub still ends the stream; it is closed after `max_duration` anyway.
+    """
+    deadline = time.monotonic() + max_duration
+    sent = None
+    async with hub.subscribe(task_id) as events:
+        # Read the current stage once subscribed, so no transition is missed
+        event = await get_progress(redis_client, task_id)
+        while True:
+            if event is not None and event != sent:
+                yield f"event: progress\ndata: {json.dumps(event)}\n\n"
+                sent = event
+                if event["stage"] in TERMINAL_STAGES:
+                    return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                yield f"event: timeout\ndata: {json.dumps({'task_id': task_id})}\n\n"
+                return
+            try:
+                event = await asyncio.wait_for(events.get(), timeout=min(heartbeat, remaining))
+            except asyncio.TimeoutError:
+                event = None
+                yield ": keep-alive\n\n"
+            if event is None:
+                event = await get_progress(redis_client, task_id)
@@ -0,0 +1,103 @@
+import os
+import asyncio
+from dotenv import load_dotenv
+from redis import Redis as SyncRedis, BlockingConnectionPool as SyncBlockingConnectionPool
+from redis.asyncio import Redis, BlockingConnectionPool
+from src.metrics import redis_pool_max_connections, redis_pool_in_use_connections
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Redis configuration
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_DB = int(os.getenv("REDIS_DB", 0))
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 5))  # Seconds to wait for a free connection
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
+
+
+class InstrumentedPool(BlockingConnectionPool):
+    """Asyncio pool exporting its utilisation to Prometheus."""
+
+    async def get_connection(self, *args, **kwargs):
+        connection = await super().get_connection(*args, **kwargs)
+        redis_pool_in_use_connections.labels(pool="async").inc()
+        return connection
+
+    async def release(self, connection):
+        await super().release(connection)
+        redis_pool_in_use_connections.labels(pool="async").dec()
+
+
+class InstrumentedSyncPool(SyncBlockingConnectionPool):
+    """Blocking pool exporting its utilisation to Prometheus."""
+
+    def get_connection(self, *args, **kwargs):
+        connection = super().get_connection(*args, **kwargs)
+        redis_pool_in_use_connections.labels(pool="sync").inc()
+        return connection
+
+    def release(self, connection):
+        super().release(connection)
+        redis_pool_in_use_connections.labels(pool="sync").dec()
+
+
+def _pool_options():
+    return {
+        "host": REDIS_HOST,
+        "port": REDIS_PORT,
+        "db": REDIS_DB,
+        "max_connections": REDIS_MAX_CONNECTIONS,
+        "timeout": REDIS_POOL_TIMEOUT,
+        "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+    }
+
+
+# Asyncio connections are bound to the event loop they were opened on,
+# so the pool is rebuilt if it is used from another loop.
+_pool = None
+_pool_loop = None
+_sync_pool = None
+
+
+def get_redis_pool() -> InstrumentedPool:
+    global _pool, _pool_loop
+    loop = asyncio.get_running_loop()
+    if _pool is None or _pool_loop is not loop:
+        _pool = InstrumentedPool(**_pool_options())
+        _pool_loop = loop
+        redis_pool_max_connections.labels(pool="async").set(REDIS_MAX_CONNECTIONS)
+    return _pool
+
+
+async def init_redis_pool():
+    """
+    Create the process-wide pool and check that Redis is reachable.
+    """
+    client = await get_redis_client()
+    await client.ping()
+
+
+async def close_redis_pool():
+    global _pool, _pool_loop
+    if _pool is not None:
+        await _pool.disconnect()
+        redis_pool_in_use_connections.labels(pool="async").set(0)
+    _pool = None
+    _pool_loop = None
+
+
+async def get_redis_client() -> Redis:
+    """
+    Return a client borrowing its connections from the shared pool.
+    """
+    return Redis(connection_pool=get_redis_pool())
+
+
+def get_sync_redis_client() -> SyncRedis:
+    global _sync_pool
+    if _sync_pool is None:
+        _sync_pool = InstrumentedSyncPool(**_pool_options())
+        redis_pool_max_connections.labels(pool="sync").set(REDIS_MAX_CONNECTIONS)
+    return SyncRedis(connection_pool=_sync_pool)
@@ -0,0 +1,248 @@
+import json
+import time
+from typing import Optional
+from redis.commands.core import AsyncScript
+from src.config import PIPELINE_VERSION, RESULT_CACHE_TTL, INFLIGHT_TTL, CHECKPOINT_TTL, CACHE_SIZE
+
+# Shared results are stored once per (pipeline version, file hash), the per-user
+# hashes `user_id:{id}` only hold a pointer (the shared key) for each file.
+RESULT_KEY_PREFIX = "result:"
+# Users whose results changed since the last sync to the `events` table
+DIRTY_USERS_KEY = "persistence:dirty_users"
+
+# Each per-user hash has a recency index `recent:{id}` (file id -> last access time)
+# and holds at most CACHE_SIZE files: linking a file evicts the least recently
+# accessed ones in the same script. Files whose access time is unknown (linked
+# before the index existed) are indexed at RECENCY_FLOOR, as the least recent.
+RECENCY_FLOOR = 0
+LINK_SCRIPT = """
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+if redis.call('ZCARD', KEYS[2]) < redis.call('HLEN', KEYS[1]) then
+    for _, file_id in ipairs(redis.call('HKEYS', KEYS[1])) do
+        redis.call('ZADD', KEYS[2], 'NX', ARGV[6], file_id)
+    end
+end
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[1])
+local evicted = {}
+local excess = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[4])
+if excess > 0 then
+    evicted = redis.call('ZRANGE', KEYS[2], 0, excess - 1)
+    redis.call('ZREM', KEYS[2], unpack(evicted))
+    redis.call('HDEL', KEYS[1], unpack(evicted))
+end
+redis.call('SADD', KEYS[3], ARGV[5])
+return evicted
+"""
+# Registered once, the client running it is given on each call (bytes need no client to be hashed)
+link_script = AsyncScript(None, LINK_SCRIPT.encode())
+
+# Section of the result filled by each crew task
+TASK_SECTIONS = {
+    "explanation_task": "explanation",
+    "evaluation_task": "evaluation",
+    "flashcard_creation_task": "flashcard_building",
+    "summary_creation_task": "summary",
+}
+
+
+def result_key(file_hash: str) -> str:
+    return f"{RESULT_KEY_PREFIX}{PIPELINE_VERSION}:{file_hash}"
+
+def inflight_key(file_hash: str) -> str:
+    return f"inflight:{PIPELINE_VERSION}:{file_hash}"
+
+def user_key(user_id) -> str:
+    return f"user_id:{user_id}"
+
+def recency_key(user_id) -> str:
+    return f"recent:{user_id}"
+
+def checkpoint_key(file_hash: str) -> str:
+    return f"checkpoint:{PIPELINE_VERSION}:{file_hash}"
+
+
+async def get_shared_result(redis_client, file_hash: str) -> Optional[dict]:
+    """
+    Return the shared result of a file if any user already processed it.
+    """
+    result = await redis_client.get(result_key(file_hash))
+    if result is None:
+        return None
+    return json.loads(result)
+
+
+async def store_shared_result(redis_client, file_hash: str, result: dict):
+    """
+    Store the result of a crew run, release the in-flight marker and drop the checkpoints of the file.
+    """
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.set(result_key(file_hash), json.dumps(result), ex=RESULT_CACHE_TTL)
+        pipe.delete(inflight_key(file_hash), checkpoint_key(file_hash))
+        await pipe.execute()
+
+
+async def store_checkpoint(redis_client, file_hash: str, task_name: str, output: str):
+    """
+    Record the output of a completed crew task. A retried or later run of the file
+    resumes from the first task without checkpoint, and the checkpoints of the
+    sections are served as a partial result while the file is processing.
+    """
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hset(checkpoint_key(file_hash), task_name, output)
+        pipe.expire(checkpoint_key(file_hash), CHECKPOINT_TTL)
+        await pipe.execute()
+
+
+async def get_checkpoints(redis_client, file_hash: str) -> dict:
+    """
+    Return the outputs of the crew tasks already completed for the file, keyed by task name.
+    """
+    outputs = await redis_client.hgetall(checkpoint_key(file_hash))
+    return {_decode(task_name): _decode(output) for task_name, output in outputs.items()}
+
+
+async def get_partial_result(redis_client, file_hash: str) -> dict:
+    checkpoints = await get_checkpoints(redis_client, file_hash)
+    return {section: checkpoints[task_name] for task_name, section in TASK_SECTIONS.items() if task_name in checkpoints}
+
+
+async def link_user_result(redis_client, user_id, file_hash: str, value: str = None, accessed_at: float = None) -> list:
+    """
+    Point the user's results to the shared entry of the file (or store `value` inline) as the
+    most recent one, and mark the user for the next sync to the database.
+    Returns the file ids evicted to stay under CACHE_SIZE.
+    """
+    evicted = await link_script(
+        keys=[user_key(user_id), recency_key(user_id), DIRTY_USERS_KEY],
+        args=[file_hash, value if value is not None else result_key(file_hash),
+              accessed_at if accessed_at is not None else time.time(), CACHE_SIZE, user_id, RECENCY_FLOOR],
+        client=redis_client,
+    )
+    return [_decode(file_id) for file_id in evicted]
+
+
+async def claim_inflight(redis_client, file_hash: str, task_id: str) -> Optional[str]:
+    """
+    Register `task_id` as the run processing the file.
+    Returns None if the claim succeeded, otherwise the id of the task already running.
+    """
+    key = inflight_key(file_hash)
+    for _ in range(2):
+        if await redis_client.set(key, task_id, nx=True, ex=INFLIGHT_TTL):
+            return None
+        running_task_id = await redis_client.get(key)
+        if running_task_id is not None:
+            return running_task_id.decode()
+        # The marker expired between the two calls, try to claim it again
+    return None
+
+
+async def release_inflight(redis_client, file_hash: str):
+    # The checkpoints are kept, the next run of the file resumes from them
+    await redis_client.delete(inflight_key(file_hash))
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+async def resolve_user_results(redis_client, entries: dict) -> dict:
+    """
+    Resolve the values of a per-user hash into results, keyed by file id.
+    Values written before the shared cache existed hold the full result inline.
+    Pointers whose shared entry does not exist (yet) are skipped.
+    """
+    return (await resolve_many_user_results(redis_client, [entries]))[0]
+
+
+async def resolve_many_user_results(redis_client, entries_list: list) -> list:
+    """
+    Resolve several per-user hashes at once, with a single MGET of the shared entries.
+    """
+    decoded = [[(_decode(file_id), _decode(value)) for file_id, value in entries.items()] for entries in entries_list]
+    pointers = list({value for entries in decoded for _, value in entries if value.startswith(RESULT_KEY_PREFIX)})
+    shared = dict(zip(pointers, await redis_client.mget(pointers))) if pointers else {}
+
+    results_list = []
+    for entries in decoded:
+        results = {}
+        for file_id, value in entries:
+            if value.startswith(RESULT_KEY_PREFIX):
+                value = shared.get(value)
+                if value is None:
+                    continue
+            results[file_id] = json.loads(value)
+        results_list.append(results)
+    return results_list
+
+
+async def get_user_result(redis_client, user_id, file_id: str) -> Optional[dict]:
+    """
+    Return a result of the user, counting as an access for the eviction.
+    """
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.hget(user_key(user_id), file_id)
+        pipe.zadd(recency_key(user_id), {file_id: time.time()}, xx=True)
+        value, _ = await pipe.execute()
+    if value is None:
+        return None
+    results = await resolve_user_results(redis_client, {file_id: value})
+    return results.get(file_id)
+
+
+async def has_user_result(redis_client, user_id, file_id: str) -> bool:
+    return bool(await redis_client.hexists(user_key(user_id), file_id))
+
+
+async def get_user_results(redis_client, user_id) -> dict:
+    entries = await redis_client.hgetall(user_key(user_id))
+    return await resolve_user_results(redis_client, entries)
+
+
+async def _index_unindexed_results(redis_client, user_id):
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.zcard(recency_key(user_id))
+        pipe.hlen(user_key(user_id))
+        indexed, stored = await pipe.execute()
+    if indexed < stored:
+        file_ids = await redis_client.hkeys(user_key(user_id))
+        await redis_client.zadd(recency_key(user_id), {file_id: RECENCY_FLOOR for file_id in file_ids}, nx=True)
+
+
+async def get_recent_user_results(redis_client, user_id, offset: int = 0, limit: int = CACHE_SIZE,
+                                  full: bool = False) -> dict:
+    """
+    Page through the user's results, most recently accessed first.
+    Items hold the file id, last access time and whether the result is ready; the
+    results themselves only with `full`.
+    """
+    await _index_unindexed_results(redis_client, user_id)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.zrevrange(recency_key(user_id), offset, offset + limit - 1, withscores=True)
+        pipe.zcard(recency_key(user_id))
+        page, total = await pipe.execute()
+
+    file_ids = [_decode(file_id) for file_id, _ in page]
+    values = await redis_client.hmget(user_key(user_id), file_ids) if file_ids else []
+    entries = {file_id: value for file_id, value in zip(file_ids, values) if value is not None}
+    if full:
+        results = await resolve_user_results(redis_client, entries)
+        ready = set(results)
+    else:
+        pointers = [_decode(value) for value in entries.values() if _decode(value).startswith(RESULT_KEY_PREFIX)]
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for pointer in pointers:
+                pipe.exists(pointer)
+            existing = dict(zip(pointers, await pipe.execute())) if pointers else {}
+        ready = {file_id for file_id, value in entries.items() if existing.get(_decode(value), True)}
+
+    items = []
+    for file_id, accessed_at in page:
+        file_id = _decode(file_id)
+        if file_id not in entries:
+            continue
+        item = {"file_id": file_id, "last_accessed": accessed_at, "ready": file_id in ready}
+        if full:
+            item["result"] = results.get(file_id)
+        items.append(item)
+    return {"items": items, "total": total, "offset": offset, "limit": limit}
@@ -1,14 +1,17 @@
-import shutil
-import json
-import datetime
-from pathlib import Path
+import uuid
 from fastapi import APIRouter, Depends, HTTPException , UploadFile, File , Request
-from src.security import get_current_service , get_current_user , get_db_pool
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from src.security import get_current_service , get_current_user
 
 from celery.result import AsyncResult
 from src.celery_app import process_file_task , celery_app
-from src.config import UPLOAD_DIR  , CACHE_SIZE
-from src.utils import get_file_hash , get_redis_client
+from src.redis_pool import get_redis_client
+from src.uploads import hash_upload
+from src.spool import upload_spool , SpoolFullError
+from src.activity import activity_accumulator
+from src.progress import publish_progress , get_progress , stream_progress
+from src.result_cache import get_shared_result , get_user_result , has_user_result , get_partial_result , link_user_result , claim_inflight , release_inflight
 
 
 
@@ -23,39 +26,90 @@ async def process_material(request: Request,file: UploadFile = File(...), curren
     
     try:
         
-        file_path = Path(UPLOAD_DIR.name) / file.filename
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        file_hash, file_size = await hash_upload(file)
+        print(f"File hash: {file_hash} ({file_size} bytes)")
+
+        # Another user (or this one) already processed the same file
+        redis_client = await get_redis_client()
+        result = await get_shared_result(redis_client, file_hash)
+        if result is not None:
+            await link_user_result(redis_client, user_id, file_hash)
+            return {"message": "Result available", "task_id": None, "file_id": file_hash, "result": result}
+
+        # Coalesce concurrent uploads of the same file on a single crew run
+        task_id = str(uuid.uuid4())
+        running_task_id = await claim_inflight(redis_client, file_hash, task_id)
+        if running_task_id:
+            await link_user_result(redis_client, user_id, file_hash)
+            return {"message": "Processing already in progress", "task_id": running_task_id, "file_id": file_hash}
 
-        file_hash = get_file_hash(file_path)
-        print(f"File hash: {file_hash}")
         print(f"Processing file : {file.filename}")
 
         # Call the Celery task
-        task = process_file_task.delay(file_path = str(file_path),
-                                        user_id = user_id,
-                                        file_id = file_hash)
+        file_path = None
+        try:
+            file_path = await run_in_threadpool(upload_spool.store, file.file, file_hash, file_size)
+            # Published before enqueueing, a fast worker's later stages must not be overwritten by it
+            await publish_progress(redis_client, task_id, "queued")
+            task = await run_in_threadpool(process_file_task.apply_async,
+                                           kwargs={"file_path": str(file_path),
+                                                   "user_id": user_id,
+                                                   "file_id": file_hash},
+                                           task_id=task_id)
+        except Exception as e:
+            # Nothing was enqueued, the next upload of the file starts a new run
+            await release_inflight(redis_client, file_hash)
+            if file_path is not None:
+                await run_in_threadpool(upload_spool.release, file_hash)
+            if isinstance(e, SpoolFullError):
+                raise HTTPException(status_code=503, detail=str(e))
+            await publish_progress(redis_client, task_id, "failed", error=str(e))
+            raise
+        # Linked once enqueued, a failed upload leaves no pointer to a result that never comes
+        await link_user_result(redis_client, user_id, file_hash)
 
         return {"message": "Processing started", "task_id": task.id , "file_id": file_hash}
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 @router.get("/task-status/{task_id}")
-def get_task_status(task_id: str, current_user=Depends(get_current_user)):
+async def get_task_status(task_id: str, current_user=Depends(get_current_user)):
+    # Progress published by the API and the worker, cheaper than the Celery result backend
+    redis_client = await get_redis_client()
+    progress = await get_progress(redis_client, task_id)
+    if progress is not None:
+        if progress["stage"] == "done":
+            return {"status": "Success"}
+        elif progress["stage"] == "failed":
+            return {"status": "Failure", "error": progress.get("error")}
+        return {"status": "Pending", "stage": progress["stage"]}
+
     # Get the task status from Celery
     task = AsyncResult(task_id , app = celery_app)
+    state = await run_in_threadpool(lambda: task.state)
 
-    if task.state == "PENDING":
+    if state == "PENDING":
         return {"status": "Pending"}
     
-    elif task.state == "SUCCESS":
+    elif state == "SUCCESS":
         return {"status": "Success"}
     
-    elif task.state == "FAILURE":
+    elif state == "FAILURE":
         return {"status": "Failure", "error": str(task.result)}
     else:
-        return {"status": task.state}
+        return {"status": state}
+
+@router.get("/task-events/{task_id}")
+async def task_events(task_id: str, current_user=Depends(get_current_user)):
+    """
+    Stream the progress of a task as Server-Sent Events until it is done or failed.
+    """
+    redis_client = await get_redis_client()
+    return StreamingResponse(stream_progress(redis_client, task_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
     
 @router.get("/get-task-result/")
 async def get_task_result(file_id: str, current_user=Depends(get_current_user)):
@@ -63,13 +117,16 @@ async def get_task_result(file_id: str, current_user=Depends(get_current_user)):
     user_id = current_user["id"]
 
     # Check if the file is in the cache
-    result = await redis_client.hget(user_id, file_id)
-    if result:
-        # Deserialize the result
-        deserialized_result = json.loads(result.decode())
-        return {"result": deserialized_result}
-    else:
-        raise HTTPException(status_code=404, detail="File not found in cache")
+    result = await get_user_result(redis_client, user_id, file_id)
+    if result is not None:
+        return {"result": result, "partial": False}
+
+    # Still processing, return the sections already produced
+    if await has_user_result(redis_client, user_id, file_id):
+        sections = await get_partial_result(redis_client, file_id)
+        if sections:
+            return {"result": sections, "partial": True}
+    raise HTTPException(status_code=404, detail="File not found in cache")
     
 @router.post("/update-task-result/{task_id}")
 async def update_task_result(task_id: str,
@@ -83,17 +140,9 @@ async def update_task_result(task_id: str,
         user_id = result['user_id']
         total_tokens = result['metadata']
         
-        # add the activity related metrics to the databases
-        db_pool = await get_db_pool()
-        async with db_pool.acquire() as conn:              
-            await conn.execute(
-                            """
-                            INSERT INTO user_activity (user_id, tokens_used, timestamp) 
-                            VALUES ($1, $2 , $3);
-                            """,user_id, total_tokens,datetime.datetime.now()
-                            )
+        # add the activity related metrics to the databases (written in bulk)
+        activity_accumulator.add(task_id, int(user_id), int(total_tokens))
 
         return {"message": "Task result updated successfully!"}
     else:
          return {"message": f"Task failed. {result['error']}"}
-   
\ No newline at end of file
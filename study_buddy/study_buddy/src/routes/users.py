@@ -1,8 +1,10 @@
 import asyncpg
-from fastapi import APIRouter, Depends, HTTPException , Request
-from passlib.hash import bcrypt
-from src.security import get_db_pool , get_current_user
-from src.utils import get_redis_client 
+from fastapi import APIRouter, Depends, HTTPException , Request , Query
+from src.security import get_db_pool , get_current_user , invalidate_user
+from src.passwords import hash_password
+from src.redis_pool import get_redis_client
+from src.config import RECENT_RESULTS_MAX_PAGE
+from src.result_cache import get_recent_user_results
 
 router = APIRouter()
 
@@ -11,21 +13,27 @@ async def register_user(username: str, password: str, db_pool=Depends(get_db_poo
     """
     Register a new user.
     """
-    hashed_password = bcrypt.hash(password)
+    hashed_password = await hash_password(password)
     async with db_pool.acquire() as conn:
         try:
             await conn.execute("INSERT INTO users (username, hashed_password) VALUES ($1, $2)", username, hashed_password)
+            invalidate_user(username)
             return {"message": "User registered successfully!"}
         except asyncpg.UniqueViolationError:
             raise HTTPException(status_code=400, detail="Username already taken")
 
 @router.get("/recent-results/")
-async def recent_results(request: Request ,current_user=Depends(get_current_user) ):
+async def recent_results(request: Request ,
+                         offset: int = Query(0, ge=0),
+                         limit: int = Query(20, ge=1, le=RECENT_RESULTS_MAX_PAGE),
+                         full: bool = False,
+                         current_user=Depends(get_current_user) ):
     """
-    Get recent processed results for the current user.
+    Get recent processed results for the current user, most recently accessed first.
+    Only the metadata of the results is returned unless `full` is set, the results
+    themselves are fetched with /get-task-result/.
     """
     user_id = current_user["id"]
     redis_client = await get_redis_client()
-    processed_cache =  await redis_client.hgetall(f"user_id:{user_id}")
-    return processed_cache
+    return await get_recent_user_results(redis_client, user_id, offset, limit, full)
 
@@ -1,11 +1,15 @@
 import os
+import asyncio
+from cachetools import TTLCache
 from jose import JWTError, jwt
-from passlib.hash import bcrypt
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
-from fastapi import Depends , HTTPException , status
+from typing import Optional
+from fastapi import Depends , HTTPException , Request , status
 from fastapi.security import OAuth2PasswordBearer
-import asyncpg
+from src.db import get_db_pool
+from src.metrics import user_cache_requests
+from src.passwords import verify_password
 
 # Load environment variables from .env file
 load_dotenv()
@@ -18,20 +22,43 @@ ALGORITHM = "HS256"
 # OAuth2PasswordBearer instance
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-# PostgreSQL connection details
-DATABASE_URL = os.getenv("DATABASE_URL")
+# Cache of the authenticated users, and of the usernames known not to exist
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 1024))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 60))
+USER_NEGATIVE_CACHE_TTL = float(os.getenv("USER_NEGATIVE_CACHE_TTL", 30))
 
-db_pool = None
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+unknown_users_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_NEGATIVE_CACHE_TTL)
+# Lookups in progress, so concurrent misses for the same user share one query
+pending_user_lookups = {}
+# Bumped by every invalidation, a lookup started before it does not cache its outcome
+user_cache_generation = 0
 
-async def get_db_pool():
-    global db_pool
-    if db_pool is None:
-        db_pool = await asyncpg.create_pool(DATABASE_URL)
-    return db_pool
 
+# Helper Functions
+def decode_token(token: str, state: Optional[dict] = None) -> dict:
+    """
+    Decode a JWT access token.
+    When given the request state (`scope["state"]`), the payload decoded by the
+    middleware for the same token is reused instead of verifying the token twice.
+    """
+    if state is not None:
+        cached = state.get("jwt")
+        if cached and cached[0] == token:
+            if isinstance(cached[1], JWTError):
+                raise cached[1]
+            return cached[1]
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError as e:
+        if state is not None:
+            state["jwt"] = (token, e)
+        raise
+    if state is not None:
+        state["jwt"] = (token, payload)
+    return payload
 
 
-# Helper Functions
 def create_access_token(data: dict, expires_delta: timedelta = None):
     """
     Generate a JWT access token.
@@ -50,38 +77,75 @@ async def get_user(db_pool, username: str):
         return await conn.fetchrow("SELECT * FROM users WHERE username = $1", username)
 
 
-async def authenticate_user(db_pool, username: str, password: str):
+async def get_cached_user(db_pool, username: str):
     """
-    Authenticate user by username and password.
+    Retrieve a user through the in-process cache.
+    """
+    user = user_cache.get(username)
+    if user is not None:
+        user_cache_requests.labels(result="hit").inc()
+        return user
+    if username in unknown_users_cache:
+        user_cache_requests.labels(result="negative_hit").inc()
+        return None
+
+    user_cache_requests.labels(result="miss").inc()
+    lookup = pending_user_lookups.get(username)
+    if lookup is None:
+        lookup = asyncio.ensure_future(load_user(db_pool, username, user_cache_generation))
+        pending_user_lookups[username] = lookup
+        lookup.add_done_callback(lambda done: _forget_lookup(username, done))
+    # Shielded so a cancelled request does not cancel the lookup of the others
+    return await asyncio.shield(lookup)
+
+
+async def load_user(db_pool, username: str, generation: int = None):
+    """
+    Retrieve a user from the database and cache the outcome, including its absence.
+    `generation` is the cache generation when the lookup was started.
     """
+    if generation is None:
+        generation = user_cache_generation
     user = await get_user(db_pool, username)
-    if user and bcrypt.verify(password, user['hashed_password']):
+    if generation != user_cache_generation:
+        # The user changed while the query ran, the outcome may be stale
         return user
-    return None
+    if user:
+        user_cache[username] = user
+    else:
+        unknown_users_cache[username] = True
+    return user
+
+
+def _forget_lookup(username: str, lookup):
+    # A lookup started after an invalidation may have replaced this one
+    if pending_user_lookups.get(username) is lookup:
+        del pending_user_lookups[username]
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db_pool= None):
+def invalidate_user(username: str):
     """
-    Get the currently authenticated user from the token.
+    Forget a cached user, to call whenever a user is created or its role changes.
     """
-    if db_pool is None:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="DB Pool not available")
-    
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        if not username:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
-        user = await get_user(db_pool, username)
-        if not user:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+    global user_cache_generation
+    user_cache_generation += 1
+    user_cache.pop(username, None)
+    unknown_users_cache.pop(username, None)
+    pending_user_lookups.pop(username, None)
+
+
+async def authenticate_user(db_pool, username: str, password: str):
+    """
+    Authenticate user by username and password.
+    """
+    user = await get_user(db_pool, username)
+    if user and await verify_password(password, user['hashed_password']):
         return user
-    except JWTError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    return None
 
 
 # Helper function to authenticate a user , this function decide which routes the user get access to
-async def get_current_user(token: str = Depends(oauth2_scheme), db_pool=Depends(get_db_pool)):
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme), db_pool=Depends(get_db_pool)):
     """
     Get the currently authenticated user from the token. This works for both users and services.
     """
@@ -89,14 +153,14 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db_pool=Depends(
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="DB Pool not available")
     
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token, request.scope.get("state"))
         username = payload.get("sub")
         role = payload.get("role")  # Check the role from the token
         if not username:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
         
-        # Retrieve user from the database (if needed)
-        user = await get_user(db_pool, username)
+        # Retrieve user from the cache, or the database on a miss
+        user = await get_cached_user(db_pool, username)
         if not user:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
         
@@ -105,12 +169,12 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db_pool=Depends(
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
     
 # Helper function to authenticate a service , this function decide which routes the service get access to
-async def get_current_service(token: str = Depends(oauth2_scheme) , db_pool=Depends(get_db_pool) ):
+async def get_current_service(request: Request, token: str = Depends(oauth2_scheme) , db_pool=Depends(get_db_pool) ):
     """
     Custom dependency to ensure only the Celery service can update the cache.
     """
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token, request.scope.get("state"))
         username = payload.get("sub")
         role = payload.get("role")  # Check the role from the token
         if not username:
@@ -10,11 +10,12 @@ load_dotenv()
 # PostgreSQL connection details
 DATABASE_URL = os.getenv("DATABASE_URL")
 password = os.getenv("CELERY_SERVICE_ACCESS_PASSWORD")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
 
 
 async def setup_services():
     db_pool = await asyncpg.create_pool(DATABASE_URL)
-    hashed_password = bcrypt.hash(password)
+    hashed_password = bcrypt.using(rounds=BCRYPT_ROUNDS).hash(password)
     async with db_pool.acquire() as conn:
         await conn.execute(""" INSERT INTO users (username, hashed_password,role)
                             VALUES ($1, $2,$3)
@@ -0,0 +1,172 @@
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import BinaryIO
+from redis import Redis
+from src.config import UPLOAD_DIR, UPLOAD_DIR_QUOTA, UPLOAD_REF_TTL, UPLOAD_CHUNK_SIZE
+from src.redis_pool import get_sync_redis_client
+
+
+class SpoolFullError(Exception):
+    """Raised when a file does not fit in the spool, even after eviction."""
+
+
+class UploadSpool:
+    """
+    Content-addressed store for the uploaded files waiting to be processed.
+
+    Files are named after their SHA-256, so identical uploads share a single file
+    and two users uploading `cours.pdf` never overwrite each other. Every Celery
+    task holding a file owns a reference on it (a Redis counter with a TTL, so the
+    references of a worker that died expire); the file is deleted when the last
+    reference is released. Files left without references are evicted in LRU order
+    whenever a new file would push the spool over its quota.
+    """
+
+    def __init__(self, directory: Path = UPLOAD_DIR, quota: int = UPLOAD_DIR_QUOTA,
+                 ref_ttl: int = UPLOAD_REF_TTL, redis_client: Redis = None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.quota = quota
+        self.ref_ttl = ref_ttl
+        self._redis = redis_client
+
+    @property
+    def redis(self) -> Redis:
+        if self._redis is None:
+            self._redis = get_sync_redis_client()
+        return self._redis
+
+    def path_for(self, file_hash: str) -> Path:
+        return self.directory / f"{file_hash}.pdf"
+
+    def _ref_key(self, file_hash: str) -> str:
+        return f"spool:ref:{file_hash}"
+
+    def _lock(self):
+        return self.redis.lock("spool:lock", timeout=30, blocking_timeout=30)
+
+    def refcount(self, file_hash: str) -> int:
+        return int(self.redis.get(self._ref_key(file_hash)) or 0)
+
+    def _reserved(self) -> int:
+        """
+        Bytes reserved by the uploads being written, a reservation whose writer died expires after `ref_ttl`.
+        """
+        self.redis.zremrangebyscore("spool:reserved", "-inf", time.time())
+        return sum(int(member.decode().rsplit(":", 1)[1]) for member in self.redis.zrange("spool:reserved", 0, -1))
+
+    def usage(self) -> int:
+        # Partial writes (dot files) are accounted for by their reservation
+        written = sum(entry.stat().st_size for entry in os.scandir(self.directory)
+                      if entry.is_file() and not entry.name.startswith("."))
+        return written + self._reserved()
+
+    def store(self, stream: BinaryIO, file_hash: str, size: int) -> Path:
+        """
+        Take a reference on the file and write it to the spool unless it is already there.
+        """
+        path = self.path_for(file_hash)
+        with self._lock():
+            # The reference protects the file from eviction as soon as it is taken
+            with self.redis.pipeline() as pipe:
+                pipe.incr(self._ref_key(file_hash))
+                pipe.expire(self._ref_key(file_hash), self.ref_ttl)
+                pipe.zadd("spool:lru", {file_hash: time.time()})
+                pipe.execute()
+            if path.exists():
+                return path
+            try:
+                self._make_room(size)
+            except SpoolFullError:
+                self._release(file_hash)
+                raise
+            # Counted in the usage until the file is written, concurrent uploads cannot overshoot the quota
+            reservation = f"{uuid.uuid4().hex}:{size}"
+            self.redis.zadd("spool:reserved", {reservation: time.time() + self.ref_ttl})
+
+        # Write under a temporary name so workers never see a partial file
+        tmp_path = self.directory / f".{file_hash}.{reservation.split(':')[0]}.tmp"
+        try:
+            stream.seek(0)
+            with open(tmp_path, "wb") as buffer:
+                while chunk := stream.read(UPLOAD_CHUNK_SIZE):
+                    buffer.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            # Nobody will process the file, drop the partial write and the reference
+            tmp_path.unlink(missing_ok=True)
+            self.release(file_hash)
+            raise
+        finally:
+            self.redis.zrem("spool:reserved", reservation)
+        return path
+
+    def release(self, file_hash: str):
+        """
+        Drop a reference on the file, deleting it once nobody holds it anymore.
+        """
+        with self._lock():
+            self._release(file_hash)
+
+    def _release(self, file_hash: str):
+        # Called with the lock held
+        remaining = self.redis.decr(self._ref_key(file_hash))
+        if remaining > 0:
+            return
+        self.redis.delete(self._ref_key(file_hash))
+        self._delete(file_hash)
+
+    def _delete(self, file_hash: str):
+        self.path_for(file_hash).unlink(missing_ok=True)
+        self.redis.zrem("spool:lru", file_hash)
+
+    def _unreferenced_files(self):
+        """
+        Spooled files without references, least recently used first.
+        """
+        entries = [entry for entry in os.scandir(self.directory)
+                   if entry.is_file() and not entry.name.startswith(".")]
+        hashes = [Path(entry.name).stem for entry in entries]
+        with self.redis.pipeline(transaction=False) as pipe:
+            for file_hash in hashes:
+                pipe.get(self._ref_key(file_hash))
+                pipe.zscore("spool:lru", file_hash)
+            replies = pipe.execute()
+
+        files = []
+        for index, (entry, file_hash) in enumerate(zip(entries, hashes)):
+            refs, last_used = replies[2 * index], replies[2 * index + 1]
+            if int(refs or 0) > 0:
+                continue
+            stat = entry.stat()
+            files.append((last_used or stat.st_mtime, file_hash, stat.st_size))
+        return sorted(files)
+
+    def _make_room(self, size: int):
+        if size > self.quota:
+            raise SpoolFullError(f"File of {size} bytes exceeds the spool quota")
+        usage = self.usage()
+        for _, file_hash, file_size in self._unreferenced_files():
+            if usage + size <= self.quota:
+                break
+            print(f"Evicting spooled file {file_hash}")
+            self._delete(file_hash)
+            usage -= file_size
+        if usage + size > self.quota:
+            raise SpoolFullError("Upload spool is full, try again later")
+
+    def reclaim(self):
+        """
+        Delete every spooled file that is no longer referenced, and stale partial writes.
+        """
+        with self._lock():
+            for _, file_hash, _ in self._unreferenced_files():
+                self._delete(file_hash)
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".tmp") and time.time() - entry.stat().st_mtime > self.ref_ttl:
+                    os.unlink(entry.path)
+
+
+upload_spool = UploadSpool()
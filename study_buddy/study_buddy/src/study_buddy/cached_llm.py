@@ -0,0 +1,27 @@
+from crewai import LLM
+from src.config import LLM_CACHE_TTL, LLM_CACHE_MAX_TEMPERATURE
+from src.study_buddy.call_cache import CallCache
+
+# Completions are cached on the exact request (model, sampling parameters and
+# messages), so a task retry, a replay or another run on the same material reuses
+# the completions already paid for. Only calls at or below LLM_CACHE_MAX_TEMPERATURE
+# (0, deterministic, by default) are cached: a sampled call is sampled again, so a
+# retry or a regeneration gets a new completion.
+llm_cache = CallCache("llm", LLM_CACHE_TTL)
+
+
+class CachedLLM(LLM):
+    def _cacheable(self, kwargs) -> bool:
+        # Function calling executes the tools inside the call, it must not be skipped
+        if kwargs.get("tools") or kwargs.get("available_functions"):
+            return False
+        # Without temperature the provider samples with its own default
+        return self.temperature is not None and self.temperature <= LLM_CACHE_MAX_TEMPERATURE
+
+    def call(self, messages, *args, **kwargs):
+        if args or not self._cacheable(kwargs):
+            return super().call(messages, *args, **kwargs)
+        key = llm_cache.key(self.model, self.base_url, self.temperature, self.top_p, self.max_tokens,
+                            self.stop, str(self.response_format), messages)
+        # Empty completions are not cached
+        return llm_cache.get_or_call(key, lambda: super(CachedLLM, self).call(messages, **kwargs) or None) or ""
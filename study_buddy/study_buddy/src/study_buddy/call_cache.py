@@ -0,0 +1,156 @@
+import re
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import Future
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from src.config import CALL_CACHE_BACKEND, CALL_CACHE_MAX_VALUE_BYTES
+from src.metrics import call_cache_requests
+
+# Results of external calls (web search, scraping, LLM completions) shared by
+# every worker through Redis, or kept in process by the local backend (offline
+# runs and tests). Identical calls running at the same time in a process wait
+# for the first one instead of being sent twice. The cache never fails a call:
+# backend errors fall back to calling through.
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+def normalize_url(url: str) -> str:
+    """
+    Lowercase the scheme and host, drop the fragment and sort the query parameters.
+    """
+    parts = urlsplit(url.strip())
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", query, ""))
+
+
+class RedisBackend:
+    def __init__(self, redis_client=None):
+        self._redis_client = redis_client
+
+    @property
+    def redis_client(self):
+        if self._redis_client is None:
+            # Imported lazily, the redis pool is only needed by the processes using the cache
+            from src.redis_pool import get_sync_redis_client
+            self._redis_client = get_sync_redis_client()
+        return self._redis_client
+
+    def get(self, key: str):
+        return self.redis_client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: int):
+        self.redis_client.set(key, value, ex=ttl)
+
+
+class LocalBackend:
+    """
+    In-process backend, for offline runs and tests.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key: str, value: bytes, ttl: int):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+
+
+def get_backend(name: str = CALL_CACHE_BACKEND):
+    if name == "redis":
+        return RedisBackend()
+    if name == "local":
+        return LocalBackend()
+    raise ValueError(f"Unknown call cache backend: {name}")
+
+
+# Shared by the caches of a process
+default_backend = get_backend()
+
+
+class CallCache:
+    """
+    TTL-bounded cache of the JSON results of a kind of call, under `call_cache:{namespace}:{key hash}`.
+    Results larger than `max_value_bytes` are returned but not stored.
+    """
+
+    def __init__(self, namespace: str, ttl: int, backend=None, max_value_bytes: int = CALL_CACHE_MAX_VALUE_BYTES):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.backend = backend if backend is not None else default_backend
+        self.max_value_bytes = max_value_bytes
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def key(self, *parts) -> str:
+        digest = hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+        return f"call_cache:{self.namespace}:{digest}"
+
+    def _get(self, key: str):
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            print(f"Call cache {self.namespace} unavailable: {e}")
+            return None
+        return None if value is None else json.loads(value)
+
+    def _set(self, key: str, result):
+        try:
+            value = json.dumps(result).encode()
+        except (TypeError, ValueError):
+            return
+        if len(value) > self.max_value_bytes:
+            return
+        try:
+            self.backend.set(key, value, self.ttl)
+        except Exception as e:
+            print(f"Call cache {self.namespace} unavailable: {e}")
+
+    def get_or_call(self, key: str, func, cacheable=None):
+        """
+        Return the cached result for `key`, otherwise the result of `func()`, cached
+        unless it is None or `cacheable(result)` is false (errors reported as results).
+        """
+        result = self._get(key)
+        if result is not None:
+            call_cache_requests.labels(namespace=self.namespace, result="hit").inc()
+            return result
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            call_cache_requests.labels(namespace=self.namespace, result="coalesced").inc()
+            return future.result()
+
+        call_cache_requests.labels(namespace=self.namespace, result="miss").inc()
+        try:
+            result = func()
+            if result is not None and (cacheable is None or cacheable(result)):
+                self._set(key, result)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
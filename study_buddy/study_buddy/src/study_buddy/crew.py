@@ -1,9 +1,14 @@
-from crewai import Agent, Crew, Process, Task, LLM
+from crewai import Agent, Crew, Process, Task
+from crewai.tasks.task_output import TaskOutput
 from crewai.project import CrewBase, agent, crew, task
-from src.study_buddy.tools.custom_tool import MaterialReadingTool , TavilyTool
+from src.study_buddy.tools.custom_tool import MaterialReadingTool , MaterialSearchTool , TavilyTool , CachedSerperDevTool , CachedScrapeWebsiteTool
+from src.study_buddy.cached_llm import CachedLLM
 from pydantic import BaseModel, Field
 from typing import Dict, List
 from dotenv import load_dotenv
+from functools import lru_cache
+import copy
+import yaml
 import os
 
 load_dotenv()
@@ -16,15 +21,10 @@ GLHF_EXPLANATION_MODEL_NAME = os.getenv("OPENAI_EXPLANATION_MODEL")
 
 
 
-from crewai_tools import (
-    SerperDevTool,
-	ScrapeWebsiteTool
-)
-
-material_reading_tool = MaterialReadingTool()
-search_tool = SerperDevTool()
-scrape_tool = ScrapeWebsiteTool()
+search_tool = CachedSerperDevTool()
+scrape_tool = CachedScrapeWebsiteTool()
 tavily_tool = TavilyTool()
+material_search_tool = MaterialSearchTool()
 
 # Pydantic output class
 class Question(BaseModel):
@@ -50,15 +50,18 @@ class FlashcardsOutput(BaseModel):
     )
 
 
-main_llm = LLM(
+main_llm = CachedLLM(
     model=GLHF_MAIN_MODEL_NAME,
 	base_url=GLHF_API_BASE_URL,
     temperature=0.7,
 	api_key=GHLF_API_KEY
 )
 
+# Large materials are summarised chunk by chunk with the main model before the ingestion
+material_reading_tool = MaterialReadingTool(llm=main_llm)
+
 # LLM configuration
-explanation_llm = LLM(
+explanation_llm = CachedLLM(
     model= GLHF_EXPLANATION_MODEL_NAME,
 	base_url=GLHF_API_BASE_URL,
 	temperature=0.4,
@@ -67,6 +70,17 @@ explanation_llm = LLM(
 
 
 
+# The configs are parsed once per process, each job gets its own copy since crewai
+# maps the agent and task instances into them
+@lru_cache(maxsize=None)
+def parse_yaml(config_path: str):
+	with open(config_path, "r", encoding="utf-8") as file:
+		return yaml.safe_load(file)
+
+def load_yaml(config_path):
+	return copy.deepcopy(parse_yaml(str(config_path)))
+
+
 # If you want to run a snippet of code before or after the crew starts, 
 # you can use the @before_kickoff and @after_kickoff decorators
 # https://docs.crewai.com/concepts/crews#example-crew-class-with-decorators
@@ -80,6 +94,11 @@ class StudyBuddy():
 	# Tasks: https://docs.crewai.com/concepts/tasks#yaml-configuration-recommended
 	agents_config = 'config/agents.yaml'
 	tasks_config = 'config/tasks.yaml'
+
+	def __init__(self):
+		# CrewBase loads the configs with self.load_yaml after this runs, its own static
+		# load_yaml shadows a method defined here but not an instance attribute
+		self.load_yaml = load_yaml
 	
 	@agent
 	def ingestion_agent(self) -> Agent:
@@ -106,6 +125,7 @@ class StudyBuddy():
 		return Agent(
 			config=self.agents_config['evaluation_specialist'],
 			verbose=True,
+			tools=[material_search_tool],
 			llm=main_llm,
 		)
 	
@@ -114,6 +134,7 @@ class StudyBuddy():
 		return Agent(
 			config=self.agents_config['flashcard_creator'],
 			verbose=True,
+			tools=[material_search_tool],
 			llm=main_llm,
             
 		)
@@ -122,6 +143,7 @@ class StudyBuddy():
 		return Agent(
 			config=self.agents_config['summarizer'],
 			verbose=True,
+			tools=[material_search_tool],
 			llm=main_llm,
             
 		)
@@ -144,7 +166,7 @@ class StudyBuddy():
 	def evaluation_task(self) -> Task:
 		return Task(
 			config=self.tasks_config['evaluation_task'],
-			context = [self.ingestion_task() , self.explanation_task()],
+			context = [self.explanation_task()],
 			output_pydantic = EvaluationOutput ,
 		)
 	
@@ -152,7 +174,7 @@ class StudyBuddy():
 	def flashcard_creation_task(self) -> Task:
 		return Task(
 			config=self.tasks_config['flashcard_creation_task'],
-			context = [self.ingestion_task() , self.explanation_task()],
+			context = [self.explanation_task()],
 			output_pydantic = FlashcardsOutput ,
 		)
 	
@@ -160,10 +182,75 @@ class StudyBuddy():
 	def summary_creation_task(self) -> Task:
 		return Task(
 			config=self.tasks_config['summary_creation_task'],
-			context = [self.ingestion_task() , self.explanation_task()],
+			context = [self.explanation_task()],
 			output_file='outputs/summary.txt'
 		)
 
+	def release(self):
+		"""
+		Drop this crew from the caches of the @agent/@task/@crew methods. crewai memoizes
+		them on `self` and never evicts, a warm worker would otherwise keep the agents,
+		tasks and outputs of every job it ran.
+		"""
+		for cls in type(self).__mro__:
+			for method in vars(cls).values():
+				code = getattr(method, "__code__", None)
+				if code is None or method.__name__ != "memoized_func" or "cache" not in code.co_freevars:
+					continue
+				cache = method.__closure__[code.co_freevars.index("cache")].cell_contents
+				for key in [key for key in cache if key[0] and key[0][0] is self]:
+					del cache[key]
+
+	def all_tasks(self) -> List[Task]:
+		return [self.ingestion_task(), self.explanation_task(), self.evaluation_task(),
+				self.flashcard_creation_task(), self.summary_creation_task()]
+
+	def restore_outputs(self, outputs: Dict[str, str]):
+		"""
+		Mark the tasks completed by a previous run as done, with their raw output.
+		They are left out of the crews and their output is read as context by the others.
+		"""
+		for task in self.all_tasks():
+			if task.name in outputs:
+				task.output = TaskOutput(
+					name=task.name,
+					description=task.description,
+					expected_output=task.expected_output,
+					raw=outputs[task.name],
+					agent=task.agent.role,
+				)
+
+	def fanout_crews(self):
+		"""
+		Crews of the parallel execution mode: a crew building the shared context
+		(ingestion and explanation), then one crew per task depending only on it.
+		crewai only allows a single trailing async task, so the independent tasks
+		run as separate crews kicked off concurrently.
+		Tasks already done are left out, the context crew is None once both are done.
+		"""
+		context_tasks = [task for task in (self.ingestion_task(), self.explanation_task()) if task.output is None]
+		branch_tasks = [task for task in (self.evaluation_task(), self.flashcard_creation_task(), self.summary_creation_task())
+						if task.output is None]
+
+		context_crew = Crew(
+			agents=[task.agent for task in context_tasks],
+			tasks=context_tasks,
+			process=Process.sequential,
+			verbose=True,
+			language = 'fr'
+		) if context_tasks else None
+		branch_crews = [
+			Crew(
+				agents=[task.agent],
+				tasks=[task],
+				process=Process.sequential,
+				verbose=True,
+				language = 'fr'
+			)
+			for task in branch_tasks
+		]
+		return context_crew, branch_crews
+
 	@crew
 	def crew(self) -> Crew:
 		"""Creates the StudyBuddy crew"""
@@ -172,7 +259,7 @@ class StudyBuddy():
 
 		return Crew(
 			agents=self.agents, # Automatically created by the @agent decorator
-			tasks=self.tasks, # Automatically created by the @task decorator
+			tasks=[task for task in self.tasks if task.output is None], # Automatically created by the @task decorator, minus the restored ones
 			process=Process.sequential,
 			verbose=True,
 			language = 'fr'
@@ -0,0 +1,140 @@
+import os
+import hashlib
+from dataclasses import dataclass
+from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from src.config import CHUNK_TOKEN_BUDGET, CHUNK_SUMMARY_WORKERS, CHUNK_SUMMARY_CACHE_DIR, CHUNK_SUMMARY_CACHE_MAX_BYTES
+from src.study_buddy.tools.pdf_extraction import ExtractedText, join_pages, read_json_cache, write_json_cache
+
+# Large materials are cut into chunks of whole pages under a token budget (pages
+# larger than the budget are cut on paragraphs), every chunk is summarised
+# concurrently (map) and the summaries are merged in reading order (reduce),
+# summarising the summaries again while they exceed the budget. Chunk summaries
+# are cached on disk by content hash (least recently used evicted beyond
+# CHUNK_SUMMARY_CACHE_MAX_BYTES), so a retry only pays for missing chunks.
+
+# Rough token count of the models we use, avoids a tokenizer dependency
+CHARS_PER_TOKEN = 4
+# Bump when the prompt changes, older summaries are then ignored
+SUMMARY_PROMPT_VERSION = 1
+SUMMARY_PROMPT = (
+    "Tu reçois un extrait d'un support de cours ({label}). Résume-le fidèlement pour "
+    "qu'il puisse être expliqué sans le document original : garde les définitions, "
+    "formules, exemples, chiffres et la structure (titres, sections). N'ajoute aucune "
+    "information absente de l'extrait.\n\n{text}"
+)
+# Guard against summaries that do not shrink the text
+MAX_REDUCE_ROUNDS = 3
+
+
+@dataclass
+class Chunk:
+    label: str
+    text: str
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _split_oversized(text: str, budget: int) -> List[str]:
+    """
+    Cut a text larger than the budget on paragraph boundaries, hard-cutting paragraphs that still exceed it.
+    """
+    max_chars = budget * CHARS_PER_TOKEN
+    parts, current = [], ""
+    for paragraph in text.split("\n\n"):
+        if len(paragraph) > max_chars:
+            # Keep the reading order: the paragraphs gathered so far come before the cut pieces
+            if current:
+                parts.append(current)
+                current = ""
+            while len(paragraph) > max_chars:
+                parts.append(paragraph[:max_chars])
+                paragraph = paragraph[max_chars:]
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            parts.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        parts.append(current)
+    return parts
+
+
+def chunk_pages(extracted: ExtractedText, budget: int = CHUNK_TOKEN_BUDGET, unit: str = "page") -> List[Chunk]:
+    """
+    Group consecutive pages into chunks of at most `budget` tokens.
+    `unit` names the pages in the chunk labels.
+    """
+    chunks = []
+    pages, first_page, tokens = [], 0, 0
+
+    def close_chunk(last_page):
+        if pages:
+            label = f"{unit} {first_page + 1}" if first_page == last_page else f"{unit}s {first_page + 1}-{last_page + 1}"
+            chunks.append(Chunk(label=label, text="\n".join(pages)))
+
+    for index in range(len(extracted.page_offsets)):
+        page = extracted.page(index)
+        page_tokens = estimate_tokens(page)
+        if page_tokens > budget:
+            close_chunk(index - 1)
+            pages, tokens = [], 0
+            for part, text in enumerate(_split_oversized(page, budget), start=1):
+                chunks.append(Chunk(label=f"{unit} {index + 1} ({part})", text=text))
+            first_page = index + 1
+            continue
+        if pages and tokens + page_tokens > budget:
+            close_chunk(index - 1)
+            pages, tokens = [], 0
+        if not pages:
+            first_page = index
+        pages.append(page)
+        tokens += page_tokens
+    close_chunk(len(extracted.page_offsets) - 1)
+    return chunks
+
+
+class ChunkSummarizer:
+    """
+    Map-reduce summarisation of a material with an LLM exposing `call(messages) -> str`.
+    """
+
+    def __init__(self, llm, workers: int = CHUNK_SUMMARY_WORKERS, cache_dir: str = CHUNK_SUMMARY_CACHE_DIR,
+                 cache_max_bytes: int = CHUNK_SUMMARY_CACHE_MAX_BYTES):
+        self.llm = llm
+        self.workers = workers
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+
+    def _cache_path(self, chunk: Chunk) -> str:
+        key = f"{SUMMARY_PROMPT_VERSION}\0{getattr(self.llm, 'model', '')}\0{chunk.text}"
+        return os.path.join(self.cache_dir, f"{hashlib.sha256(key.encode()).hexdigest()}.json")
+
+    def summarize_chunk(self, chunk: Chunk) -> str:
+        path = self._cache_path(chunk)
+        cached = read_json_cache(path)
+        if cached is not None:
+            return cached
+        prompt = SUMMARY_PROMPT.format(label=chunk.label, text=chunk.text)
+        summary = self.llm.call([{"role": "user", "content": prompt}])
+        write_json_cache(path, summary, self.cache_max_bytes)
+        return summary
+
+    def map(self, chunks: List[Chunk]) -> List[str]:
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(self.summarize_chunk, chunks))
+
+    def summarize(self, extracted: ExtractedText, budget: int) -> str:
+        """
+        Reduce the material to at most `budget` tokens (best effort after MAX_REDUCE_ROUNDS).
+        """
+        chunks = chunk_pages(extracted)
+        for _ in range(MAX_REDUCE_ROUNDS):
+            summaries = self.map(chunks)
+            merged = "\n\n".join(f"## {chunk.label}\n{summary}" for chunk, summary in zip(chunks, summaries))
+            if estimate_tokens(merged) <= budget or len(chunks) == 1:
+                return merged
+            # Summarise groups of consecutive summaries again
+            chunks = chunk_pages(join_pages(summaries), unit="partie")
+        return merged
@@ -1,13 +1,71 @@
+import re
+import requests
+from bs4 import BeautifulSoup
 from crewai.tools import BaseTool
-from typing import Type
+from typing import Any, Optional, Type
 from pydantic import BaseModel, Field
+from functools import lru_cache
 from langchain_community.tools import TavilySearchResults
-from PyPDF2 import PdfReader
+from crewai_tools import SerperDevTool, ScrapeWebsiteTool
+from src.config import INGESTION_TOKEN_BUDGET, SEARCH_CACHE_TTL, SCRAPE_CACHE_TTL, RAW_CONTENT_MAX_CHARS
+from src.study_buddy.call_cache import CallCache, normalize_query, normalize_url
+from src.study_buddy.tools.pdf_extraction import extract_text
+from src.study_buddy.tools.chunking import ChunkSummarizer, estimate_tokens
+from src.study_buddy.tools.vector_index import material_indexes
 
 class MyCustomTavilyToolInput(BaseModel):
     """Input schema for MyCustomTavilyTool."""
     query: str = Field(..., description="URL to search for.")
 
+# Searches and scraped pages recur across students studying the same topic
+tavily_cache = CallCache("tavily", SEARCH_CACHE_TTL)
+serper_cache = CallCache("serper", SEARCH_CACHE_TTL)
+scrape_cache = CallCache("scrape", SCRAPE_CACHE_TTL)
+# Bump when the cached value of a scrape changes, older entries are then ignored
+SCRAPE_CACHE_VERSION = 2
+
+
+def trim_raw_content(results):
+    """
+    Cap the raw page content of search results, it dominates their size.
+    """
+    if isinstance(results, list):
+        for result in results:
+            if isinstance(result, dict) and isinstance(result.get("raw_content"), str):
+                result["raw_content"] = result["raw_content"][:RAW_CONTENT_MAX_CHARS]
+    return results
+
+
+# The tools answer failed calls instead of raising: only actual results are
+# cached, errors (auth, credits, rate limit, blocked pages) are never served to others.
+def is_tavily_result(result) -> bool:
+    # The langchain tool returns the repr of the error instead of the list of results
+    return isinstance(result, list)
+
+
+def is_serper_result(result) -> bool:
+    # Errors are the JSON payload of the API, without "organic" results
+    if isinstance(result, dict):
+        return "organic" in result
+    return isinstance(result, str) and result.lstrip().startswith("Search results:")
+
+
+def is_page(page: dict) -> bool:
+    # Error pages (403, 429, 5xx) are returned with a success of the scrape
+    return 200 <= page["status"] < 300
+
+
+@lru_cache(maxsize=1)
+def get_tavily_client() -> TavilySearchResults:
+    # A single client (and HTTP session) per process
+    return TavilySearchResults(
+                                max_results=5,
+                                include_answer=True,
+                                include_raw_content=True,
+                                include_images=True,
+                            )
+
+
 class TavilyTool(BaseTool):
     name: str = "Tavily Search Tool"
     description: str = "Search the web for a given query. Can also scrape and gather images ,\
@@ -15,14 +73,44 @@ class TavilyTool(BaseTool):
     args_schema: Type[BaseModel] = MyCustomTavilyToolInput
 
     def _run(self, query: str) -> str:
-        tavily_tool = TavilySearchResults(
-                                        max_results=5,
-                                        include_answer=True,
-                                        include_raw_content=True,
-                                        include_images=True,
-                                    )
-        response = tavily_tool.invoke(query)
-        return response
+        key = tavily_cache.key(normalize_query(query))
+        return tavily_cache.get_or_call(key, lambda: trim_raw_content(get_tavily_client().invoke(query)),
+                                        cacheable=is_tavily_result)
+
+
+class CachedSerperDevTool(SerperDevTool):
+    """SerperDevTool answering repeated searches from the call cache."""
+
+    def _run(self, **kwargs: Any) -> Any:
+        # Every argument is part of the key (canonical JSON), the query text is normalised
+        arguments = {name: normalize_query(value) if name in ("search_query", "query") and isinstance(value, str) else value
+                     for name, value in kwargs.items()}
+        key = serper_cache.key(arguments, self.n_results, getattr(self, "search_type", None))
+        return serper_cache.get_or_call(key, lambda: super(CachedSerperDevTool, self)._run(**kwargs),
+                                        cacheable=is_serper_result)
+
+
+class CachedScrapeWebsiteTool(ScrapeWebsiteTool):
+    """ScrapeWebsiteTool answering repeated scrapes of a page from the call cache."""
+
+    def _scrape(self, url: str) -> dict:
+        """
+        Fetch and clean the page as ScrapeWebsiteTool does, keeping the HTTP status it ignores.
+        """
+        page = requests.get(url, timeout=15, headers=self.headers, cookies=self.cookies or {})
+        page.encoding = page.apparent_encoding
+        text = BeautifulSoup(page.text, "html.parser").get_text(" ")
+        text = re.sub(r"[ \t]+", " ", text)
+        text = re.sub(r"\s+\n\s+", "\n", text)
+        return {"status": page.status_code, "text": text[:RAW_CONTENT_MAX_CHARS]}
+
+    def _run(self, **kwargs: Any) -> Any:
+        url = kwargs.get("website_url") or self.website_url or ""
+        key = scrape_cache.key(normalize_url(url), SCRAPE_CACHE_VERSION)
+        page = scrape_cache.get_or_call(key, lambda: self._scrape(url), cacheable=is_page)
+        if not is_page(page):
+            return f"Failed to scrape {url}: HTTP {page['status']}"
+        return page["text"]
 
 
 
@@ -37,10 +125,33 @@ class MaterialReadingTool(BaseTool):
         "This tool is designed to load and read the content of the study material"
     )
     args_schema: Type[BaseModel] = StudyMaterialInput
+    # Summarises the materials exceeding the ingestion budget, they are returned whole without it
+    llm: Optional[Any] = Field(default=None, exclude=True)
+    token_budget: int = INGESTION_TOKEN_BUDGET
 
     def _run(self, path: str) -> str:
-        reader = PdfReader(path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text()
-        return text
+        extracted = extract_text(path)
+        if self.llm is None or estimate_tokens(extracted.text) <= self.token_budget:
+            return extracted.text
+        return ChunkSummarizer(self.llm).summarize(extracted, self.token_budget)
+
+
+
+class MaterialSearchInput(BaseModel):
+    """Input schema for MaterialSearchTool."""
+    path: str = Field(..., description="the path to the study material")
+    query: str = Field(..., description="what to look for in the study material")
+
+
+class MaterialSearchTool(BaseTool):
+    name: str = "Study material search tool"
+    description: str = (
+        "Return the passages of the study material most relevant to a query, "
+        "use it to check a definition, an example or a detail of the original material"
+    )
+    args_schema: Type[BaseModel] = MaterialSearchInput
+    top_k: int = 5
+
+    def _run(self, path: str, query: str) -> str:
+        results = material_indexes.search(path, query, self.top_k)
+        return "\n\n".join(f"[{label}]\n{passage}" for label, passage, _ in results)
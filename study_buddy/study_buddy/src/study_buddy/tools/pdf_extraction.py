@@ -0,0 +1,211 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+import multiprocessing
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from PyPDF2 import PdfReader
+from src.config import PDF_TEXT_CACHE_DIR, PDF_TEXT_CACHE_MAX_BYTES, PDF_EXTRACTION_WORKERS, PDF_PARALLEL_MIN_PAGES
+
+# The text of a PDF is extracted once per file content: pages are parsed in
+# parallel processes where possible, joined, and cached on disk under the sha256
+# of the file together with the offset of each page, so every agent call and
+# task retry on the same material reuses it. The on-disk caches are bounded: the
+# least recently used entries (by mtime, refreshed on every hit) are evicted.
+
+# Bump when the extraction output changes, older cache entries are then ignored
+EXTRACTION_VERSION = 1
+PAGE_SEPARATOR = "\n"
+# Partial writes older than this were left by a process that died
+STALE_TMP_SECONDS = 3600
+
+
+@dataclass
+class ExtractedText:
+    text: str
+    page_offsets: List[int]  # Offset of the first character of each page in `text`
+
+    def page(self, index: int) -> str:
+        end = self.page_offsets[index + 1] - len(PAGE_SEPARATOR) if index + 1 < len(self.page_offsets) else len(self.text)
+        return self.text[self.page_offsets[index]:end]
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def material_hash(path: str, file_hash: Optional[str] = None) -> str:
+    """
+    The sha256 of a material: `file_hash` when known, else the name of spooled
+    files (named after their sha256), else hashed from the content.
+    """
+    if file_hash:
+        return file_hash
+    stem = Path(path).stem
+    if re.fullmatch(r"[0-9a-f]{64}", stem):
+        return stem
+    return file_sha256(path)
+
+
+def _pages_text(reader: PdfReader, start: int, stop: int) -> List[str]:
+    return [reader.pages[index].extract_text() or "" for index in range(start, stop)]
+
+
+def _extract_page_range(path: str, start: int, stop: int) -> List[str]:
+    """
+    Extract the text of pages [start, stop) in a worker process, which opens its own reader.
+    """
+    return _pages_text(PdfReader(path), start, stop)
+
+
+def _page_ranges(page_count: int, parts: int):
+    step, remainder = divmod(page_count, parts)
+    start = 0
+    for part in range(parts):
+        stop = start + step + (1 if part < remainder else 0)
+        if stop > start:
+            yield start, stop
+        start = stop
+
+
+def extract_pages(path: str, workers: int = PDF_EXTRACTION_WORKERS) -> List[str]:
+    """
+    Extract the text of every page, in order.
+    PyPDF2 is pure Python: pages are only parsed in parallel by processes. Celery pool
+    processes are daemonic and cannot have children, they extract sequentially with
+    a single reader (threads would hold the GIL and parse the file once per thread).
+    """
+    reader = PdfReader(path)
+    page_count = len(reader.pages)
+    if workers <= 1 or page_count < PDF_PARALLEL_MIN_PAGES or multiprocessing.current_process().daemon:
+        return _pages_text(reader, 0, page_count)
+
+    ranges = list(_page_ranges(page_count, workers))
+    with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [executor.submit(_extract_page_range, path, start, stop) for start, stop in ranges]
+        return [text for future in futures for text in future.result()]
+
+
+def join_pages(pages: List[str]) -> ExtractedText:
+    offsets = []
+    offset = 0
+    for page in pages:
+        offsets.append(offset)
+        offset += len(page) + len(PAGE_SEPARATOR)
+    return ExtractedText(text=PAGE_SEPARATOR.join(pages), page_offsets=offsets)
+
+
+def _cache_path(file_hash: str) -> str:
+    return os.path.join(PDF_TEXT_CACHE_DIR, f"{file_hash}.v{EXTRACTION_VERSION}.json")
+
+
+def touch_cache_entry(path: str):
+    # Marks the entry as recently used for the eviction
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _remove(path: str):
+    # Another process may have evicted it already
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def evict_cache_entries(directory: str, max_bytes: int):
+    """
+    Delete the least recently used entries of a cache directory until it holds at most `max_bytes`.
+    """
+    now = time.time()
+    entries, usage = [], 0
+    try:
+        with os.scandir(directory) as scan:
+            for entry in scan:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if ".tmp" in entry.name:
+                    if now - stat.st_mtime > STALE_TMP_SECONDS:
+                        _remove(entry.path)
+                    continue
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+                usage += stat.st_size
+        for _, path, size in sorted(entries):
+            if usage <= max_bytes:
+                break
+            _remove(path)
+            usage -= size
+    except OSError as e:
+        print(f"Failed to evict the cache entries of {directory}: {e}")
+
+
+def read_json_cache(path: str):
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    touch_cache_entry(path)
+    return data
+
+
+def write_json_cache(path: str, data, max_bytes: Optional[int] = None):
+    """
+    Write a cache entry atomically, readers never see a partial file.
+    With `max_bytes`, the least recently used entries of its directory are then evicted beyond it.
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Failed to write the cache entry {path}: {e}")
+        return
+    if max_bytes is not None:
+        evict_cache_entries(os.path.dirname(path), max_bytes)
+
+
+# Concurrent calls on the same file in this process wait for a single extraction.
+# Each entry is [lock, number of callers holding or waiting for it].
+_extraction_locks = {}
+_extraction_locks_guard = threading.Lock()
+
+
+def extract_text(path: str, file_hash: Optional[str] = None) -> ExtractedText:
+    """
+    Return the text of a PDF, from the disk cache when the same content was already extracted.
+    """
+    file_hash = material_hash(path, file_hash)
+    with _extraction_locks_guard:
+        entry = _extraction_locks.setdefault(file_hash, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            cached = read_json_cache(_cache_path(file_hash))
+            if cached is not None:
+                return ExtractedText(**cached)
+            extracted = join_pages(extract_pages(path))
+            write_json_cache(_cache_path(file_hash), {"text": extracted.text, "page_offsets": extracted.page_offsets},
+                             PDF_TEXT_CACHE_MAX_BYTES)
+            return extracted
+    finally:
+        # Dropped by the last caller only, a waiter never gets a fresh lock while another extracts
+        with _extraction_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _extraction_locks[file_hash]
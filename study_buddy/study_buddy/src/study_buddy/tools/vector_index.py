@@ -0,0 +1,176 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+from src.config import VECTOR_INDEX_DIR, VECTOR_INDEX_MAX_BYTES, EMBEDDER, PASSAGE_TOKEN_BUDGET
+from src.study_buddy.tools.pdf_extraction import extract_text, material_hash, touch_cache_entry, evict_cache_entries
+from src.study_buddy.tools.chunking import chunk_pages
+
+# Passages of a material are embedded once per (file content, embedder) and kept
+# on disk as a NumPy matrix of unit vectors, a search is a single matrix-vector
+# product. Agents query it through MaterialSearchTool instead of receiving the
+# whole material as context. The least recently used indexes are evicted from
+# the disk beyond VECTOR_INDEX_MAX_BYTES.
+
+# Bump when the passage splitting changes, older indexes are then rebuilt
+INDEX_VERSION = 1
+EMBEDDING_BATCH_SIZE = 64
+
+
+class HashingEmbedder:
+    """
+    Local embedding without model: signed feature hashing of the words and word pairs.
+    Captures lexical overlap only, which is what finding the passages of a material needs.
+    """
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str):
+        words = re.findall(r"\w+", text.lower())
+        return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+                vectors[row, digest % self.dim] += 1.0 if digest >> 63 else -1.0
+        # Dampen frequent words
+        np.copysign(np.log1p(np.abs(vectors)), vectors, out=vectors)
+        return _normalize(vectors)
+
+
+class SentenceTransformerEmbedder:
+    """
+    Embedding with a local sentence-transformers model (optional dependency).
+    """
+
+    def __init__(self, model_name: str):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise RuntimeError("EMBEDDER=sentence-transformers:<model> requires the sentence-transformers package") from e
+        self.model = SentenceTransformer(model_name)
+        self.name = f"st-{model_name.replace('/', '_')}"
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        return _normalize(np.asarray(self.model.encode(texts), dtype=np.float32))
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def get_embedder(spec: str = EMBEDDER):
+    """
+    Build the embedder described by `spec`: "hashing[:dim]" or "sentence-transformers:<model>".
+    """
+    kind, _, arg = spec.partition(":")
+    if kind == "hashing":
+        return HashingEmbedder(int(arg)) if arg else HashingEmbedder()
+    if kind == "sentence-transformers":
+        return SentenceTransformerEmbedder(arg)
+    raise ValueError(f"Unknown embedder: {spec}")
+
+
+class VectorIndex:
+    def __init__(self, passages: List[str], labels: List[str], vectors: np.ndarray):
+        self.passages = passages
+        self.labels = labels
+        self.vectors = vectors
+
+    def search(self, query_vector: np.ndarray, k: int = 5):
+        """
+        Return the (label, passage, score) of the `k` passages closest to the query, best first.
+        """
+        if not self.passages:
+            return []
+        scores = self.vectors @ query_vector
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(self.labels[i], self.passages[i], float(scores[i])) for i in best]
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez(tmp_path, vectors=self.vectors,
+                 metadata=np.array(json.dumps({"passages": self.passages, "labels": self.labels})))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["VectorIndex"]:
+        try:
+            with np.load(path) as data:
+                metadata = json.loads(str(data["metadata"]))
+                index = cls(metadata["passages"], metadata["labels"], data["vectors"])
+        except (OSError, ValueError, KeyError):
+            return None
+        touch_cache_entry(path)
+        return index
+
+
+class MaterialIndexes:
+    """
+    Indexes of the materials, built once per file content and kept in memory for the recent ones.
+    """
+
+    def __init__(self, embedder=None, index_dir: str = VECTOR_INDEX_DIR, max_loaded: int = 8,
+                 max_bytes: int = VECTOR_INDEX_MAX_BYTES):
+        self._embedder = embedder
+        self.index_dir = index_dir
+        self.max_bytes = max_bytes
+        self.max_loaded = max_loaded
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def embedder(self):
+        # Built on first use, a model based embedder is expensive to load
+        if self._embedder is None:
+            self._embedder = get_embedder()
+        return self._embedder
+
+    def _index_path(self, file_hash: str) -> str:
+        return os.path.join(self.index_dir, f"{file_hash}.{self.embedder.name}.v{INDEX_VERSION}.npz")
+
+    def _build(self, path: str, file_hash: str) -> VectorIndex:
+        chunks = [chunk for chunk in chunk_pages(extract_text(path, file_hash), budget=PASSAGE_TOKEN_BUDGET)
+                  if chunk.text.strip()]
+        passages = [chunk.text for chunk in chunks]
+        batches = [self.embedder(passages[start:start + EMBEDDING_BATCH_SIZE])
+                   for start in range(0, len(passages), EMBEDDING_BATCH_SIZE)]
+        vectors = np.concatenate(batches) if batches else np.zeros((0, 1), dtype=np.float32)
+        return VectorIndex(passages, [chunk.label for chunk in chunks], vectors)
+
+    def get(self, path: str, file_hash: str = None) -> VectorIndex:
+        file_hash = material_hash(path, file_hash)
+        # A single lock: building is rare and agents of a crew query the same material
+        with self._lock:
+            index = self._loaded.get(file_hash)
+            if index is None:
+                index_path = self._index_path(file_hash)
+                index = VectorIndex.load(index_path)
+                if index is None:
+                    index = self._build(path, file_hash)
+                    index.save(index_path)
+                    evict_cache_entries(self.index_dir, self.max_bytes)
+                self._loaded[file_hash] = index
+                if len(self._loaded) > self.max_loaded:
+                    self._loaded.popitem(last=False)
+            self._loaded.move_to_end(file_hash)
+            return index
+
+    def search(self, path: str, query: str, k: int = 5, file_hash: str = None):
+        index = self.get(path, file_hash)
+        return index.search(self.embedder([query])[0], k)
+
+
+material_indexes = MaterialIndexes()
@@ -0,0 +1,35 @@
+import hashlib
+from fastapi import HTTPException, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from src.config import MAX_UPLOAD_SIZE, UPLOAD_CHUNK_SIZE
+
+# Starlette already spools the multipart body (in memory, then on disk), so the
+# upload is hashed straight from that spool and only copied into the upload
+# spool (see src/spool.py) when the file has to be processed. Each pass runs as
+# a single job on the threadpool so the event loop never blocks on file I/O.
+
+
+def _too_large():
+    return HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                         detail=f"File exceeds the maximum upload size of {MAX_UPLOAD_SIZE} bytes")
+
+
+def _hash_stream(stream, max_size: int, chunk_size: int):
+    sha256 = hashlib.sha256()
+    size = 0
+    stream.seek(0)
+    while chunk := stream.read(chunk_size):
+        size += len(chunk)
+        if size > max_size:
+            raise _too_large()
+        sha256.update(chunk)
+    return sha256.hexdigest(), size
+
+
+async def hash_upload(file: UploadFile, max_size: int = MAX_UPLOAD_SIZE, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    """
+    Return the SHA-256 and the size of an uploaded file, enforcing the size limit.
+    """
+    if file.size is not None and file.size > max_size:
+        raise _too_large()
+    return await run_in_threadpool(_hash_stream, file.file, max_size, chunk_size)
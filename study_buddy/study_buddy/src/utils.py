@@ -1,47 +1,106 @@
-import os
-import json
+import asyncio
 from src.study_buddy.crew import StudyBuddy
 from pathlib import Path
 from dotenv import load_dotenv
-from redis.asyncio import Redis
 import hashlib
 import datetime
+import time
 from typing import Optional
+from crewai.types.usage_metrics import UsageMetrics
+from src.config import CREW_EXECUTION_MODE
+from src.metrics import crew_task_duration_seconds, crew_run_duration_seconds, crew_job_overhead_seconds
 from src.security import get_db_pool
+from src.redis_pool import get_redis_client
+from src.result_cache import (get_shared_result, store_shared_result, store_checkpoint, get_checkpoints,
+                              link_user_result, release_inflight, TASK_SECTIONS)
+from src.progress import publish_progress, STAGE_AFTER_COMPLETED_TASKS
 
 
 # Load environment variables from .env file
 load_dotenv()
 
 
+async def run_crew(crew, inputs: dict, mode: str, on_task_output=None):
+    """
+    Kick off a crew, timing each of its tasks.
+    `on_task_output` is awaited with the output of each task as soon as it completes.
+    """
+    # The crew runs in a worker thread, hand its task outputs back to the event loop
+    loop = asyncio.get_running_loop()
+    pending_callbacks = []
+    last_completion = time.monotonic()
+
+    def task_callback(task_output):
+        nonlocal last_completion
+        now = time.monotonic()
+        crew_task_duration_seconds.labels(task=task_output.name, mode=mode).observe(now - last_completion)
+        last_completion = now
+        if on_task_output is not None:
+            pending_callbacks.append(asyncio.run_coroutine_threadsafe(on_task_output(task_output), loop))
+    crew.task_callback = task_callback
+
+    try:
+        return await crew.kickoff_async(inputs=inputs)
+    finally:
+        # Checkpoints of the tasks completed before a failure are kept as well
+        for callback in pending_callbacks:
+            await asyncio.wrap_future(callback)
+
 
-async def process_study_material(file_path: Path):
+async def process_study_material(file_path: Path, on_task_output=None, checkpoints: Optional[dict] = None):
     """
     Process the study material and return the results.
-    Replace this placeholder with the actual logic for processing the file.
+    `on_task_output` is awaited with the output of each crew task as soon as it completes.
+    `checkpoints` maps the tasks completed by a previous run to their raw output, they are not run again.
     """
+    study_buddy = None
     try:
         inputs = {
             'study_material_path': file_path
         }
-        results = await StudyBuddy().crew().kickoff_async(inputs=inputs)
-        results = dict(results)
-        tasks = ['explanation', 'evaluation', 'flashcard_building', 'summary']
-        tasks_output = results['tasks_output'][1:]
-        final_result = {task: task_output.raw for task, task_output in zip(tasks, tasks_output)}
-        return final_result, results['token_usage']
-    
-    except Exception as e:
-        raise RuntimeError(f"Error processing material: {str(e)}")
-    
-# Redis configuration
-REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+        mode = CREW_EXECUTION_MODE
+        start = time.monotonic()
+        study_buddy = StudyBuddy()
+        study_buddy.restore_outputs(checkpoints or {})
+        if mode == "parallel":
+            # The evaluation, flashcards and summary only depend on the ingestion and explanation
+            context_crew, branch_crews = study_buddy.fanout_crews()
+        elif any(task.output is None for task in study_buddy.all_tasks()):
+            crew = study_buddy.crew()
+        else:
+            crew = None
+        crew_job_overhead_seconds.labels(mode=mode).observe(time.monotonic() - start)
 
-async def get_redis_client():
-    client = Redis(host= REDIS_HOST, port=6379, db=0)
-    return client
+        outputs = []
+        if mode == "parallel":
+            if context_crew is not None:
+                outputs.append(await run_crew(context_crew, inputs, mode, on_task_output))
+            # Let every branch finish (and checkpoint) before reporting a failure
+            branch_outputs = await asyncio.gather(*(run_crew(branch_crew, inputs, mode, on_task_output)
+                                                    for branch_crew in branch_crews), return_exceptions=True)
+            for output in branch_outputs:
+                if isinstance(output, BaseException):
+                    raise output
+            outputs.extend(branch_outputs)
+        elif crew is not None:
+            outputs.append(await run_crew(crew, inputs, mode, on_task_output))
+        crew_run_duration_seconds.labels(mode=mode).observe(time.monotonic() - start)
 
+        token_usage = UsageMetrics()
+        for output in outputs:
+            token_usage.add_usage_metrics(output.token_usage)
 
+        final_result = {TASK_SECTIONS[task.name]: task.output.raw
+                        for task in study_buddy.all_tasks() if task.name in TASK_SECTIONS}
+        return final_result, token_usage
+    
+    except Exception as e:
+        raise RuntimeError(f"Error processing material: {str(e)}") from e
+    finally:
+        # The worker is long-lived, let the agents and tasks of this job be collected
+        if study_buddy is not None:
+            study_buddy.release()
+    
 # hash the file content to check if it has already been processed
 def get_file_hash(file_path: Path, chunk_size: int = 8192) -> str:
     sha256 = hashlib.sha256()
@@ -50,31 +109,70 @@ def get_file_hash(file_path: Path, chunk_size: int = 8192) -> str:
             sha256.update(chunk)
     return sha256.hexdigest()
 
+async def report_progress(redis_client, task_id: Optional[str], stage: str, **details):
+    """
+    Publish the progress of a task, progress reporting never fails the processing.
+    """
+    if task_id is None:
+        return
+    try:
+        await publish_progress(redis_client, task_id, stage, **details)
+    except Exception as e:
+        print(f"Failed to publish the progress of task {task_id}: {e}")
+
 # celery task to process the file
-async def process_file_main(file_path: Path, user_id: str, file_id: str):
+async def process_file_main(file_path: Path, user_id: str, file_id: str, task_id: Optional[str] = None,
+                            final_attempt: bool = True):
     """
     Main function to process the file and return the results.
+    Errors are raised for the Celery task to retry, the retry resumes from the checkpoints.
+    After the final attempt the file is released for a new run and the task reported as failed.
     """
+    redis_client = await get_redis_client()
     try:
-        redis_client = await get_redis_client()
-        result = await redis_client.hget(f"user_id:{user_id}", file_id)
+        result = await get_shared_result(redis_client, file_id)
         if result:
             print(f"File {file_id}  found in cache. Reeturning")
-            # Deserialize the result
-            deserialized_result = json.loads(result.decode())
-            return {"filename": file_path, "result": deserialized_result , "user_id":user_id , "metadata": 0}
+            await link_user_result(redis_client, user_id, file_id)
+            await report_progress(redis_client, task_id, "done")
+            return {"filename": file_path, "result": result , "user_id":user_id , "metadata": 0}
         else:
-            print(f"File {file_id} not found in cache. Processing...")
-            result, token_usage = await process_study_material(file_path)
+            checkpoints = await get_checkpoints(redis_client, file_id)
+            print(f"File {file_id} not found in cache. Processing ({len(checkpoints)} tasks already done)...")
+            completed_tasks = len(checkpoints)
+            await report_progress(redis_client, task_id,
+                                  STAGE_AFTER_COMPLETED_TASKS[min(completed_tasks, len(STAGE_AFTER_COMPLETED_TASKS) - 1)])
 
-            # Store the result in Redis cache
-            await redis_client.hset(f"user_id:{user_id}", file_id, json.dumps(result))
+            async def on_task_output(task_output):
+                nonlocal completed_tasks
+                completed_tasks += 1
+                # Checkpoint each task as soon as it is done, the sections are served as a partial result meanwhile
+                try:
+                    await store_checkpoint(redis_client, file_id, task_output.name, task_output.raw)
+                except Exception as e:
+                    print(f"Failed to checkpoint {task_output.name} of file {file_id}: {e}")
+                if completed_tasks < len(STAGE_AFTER_COMPLETED_TASKS):
+                    stage = STAGE_AFTER_COMPLETED_TASKS[completed_tasks]
+                    await report_progress(redis_client, task_id, stage, completed=task_output.name)
+
+            result, token_usage = await process_study_material(file_path, on_task_output, checkpoints)
+
+            # Store the result in the shared cache and point the user to it
+            await store_shared_result(redis_client, file_id, result)
+            await link_user_result(redis_client, user_id, file_id)
+            await report_progress(redis_client, task_id, "done")
             
             print(f"Processing completed")
             return {"filename": file_path, "result": result , "user_id":user_id ,"metadata":token_usage.total_tokens}
     except Exception as e:
         print(f"An error occurred: {e}")
-        return {"error": str(e)}
-    
-
-
+        if not final_attempt:
+            await report_progress(redis_client, task_id, "retrying", error=str(e))
+            raise
+        # Let the next upload of this file start a new run
+        try:
+            await release_inflight(redis_client, file_id)
+        except Exception as release_error:
+            print(f"Failed to release file {file_id}: {release_error}")
+        await report_progress(redis_client, task_id, "failed", error=str(e))
+        raise
@@ -0,0 +1,57 @@
+import os
+import uuid
+import asyncio
+import asyncpg
+import pytest
+from src.lifespan import create_schema
+
+# The SQL tests run against this database (in a schema of their own), skipped without it
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+class Database:
+    def __init__(self, url: str, schema: str):
+        self.url = url
+        self.schema = schema
+
+    def pool(self):
+        """
+        A pool on the schema of the test, to create in the event loop of the test.
+        """
+        return asyncpg.create_pool(self.url, min_size=1, max_size=4,
+                                   server_settings={"search_path": self.schema})
+
+
+async def connect_schema(url: str, schema: str):
+    conn = await asyncpg.connect(url)
+    await conn.execute(f'CREATE SCHEMA "{schema}"')
+    await conn.execute(f'SET search_path TO "{schema}"')
+    return conn
+
+
+@pytest.fixture
+def database():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    schema = f"test_{uuid.uuid4().hex}"
+
+    async def setup():
+        conn = await connect_schema(TEST_DATABASE_URL, schema)
+        try:
+            await create_schema(conn, daily_rollup=True)
+        finally:
+            await conn.close()
+
+    async def teardown():
+        conn = await asyncpg.connect(TEST_DATABASE_URL)
+        try:
+            await conn.execute(f'DROP SCHEMA "{schema}" CASCADE')
+        finally:
+            await conn.close()
+
+    try:
+        asyncio.run(setup())
+    except (OSError, asyncpg.PostgresError) as e:
+        pytest.skip(f"Test database unavailable: {e}")
+    yield Database(TEST_DATABASE_URL, schema)
+    asyncio.run(teardown())
@@ -0,0 +1,117 @@
+import asyncio
+from datetime import datetime
+import pytest
+from src.activity import ActivityAccumulator
+
+
+class UnavailableDatabase:
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        raise ConnectionRefusedError("database down")
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class HangingDatabase(UnavailableDatabase):
+    async def __aenter__(self):
+        await asyncio.sleep(3600)
+
+
+DAY = datetime(2026, 10, 18, 12)
+
+
+async def add_users(db_pool, *user_ids):
+    await db_pool.executemany("INSERT INTO users (id, username, hashed_password) VALUES ($1, $2, 'x')",
+                              [(user_id, f"user{user_id}") for user_id in user_ids])
+
+
+async def written_activity(db_pool):
+    rows = await db_pool.fetch("SELECT task_id, user_id, tokens_used FROM user_activity")
+    return {row["task_id"]: (row["user_id"], row["tokens_used"]) for row in rows}
+
+
+def test_redelivered_rows_are_counted_once(database):
+    accumulator = ActivityAccumulator(daily_rollup=True)
+
+    async def scenario():
+        async with database.pool() as db_pool:
+            await add_users(db_pool, 1, 2)
+            accumulator.add("t1", 1, 100, DAY)
+            accumulator.add("t2", 1, 50, DAY)
+            await accumulator.flush(db_pool)
+            # The outbox delivers t2 again
+            accumulator.add("t2", 1, 50, DAY)
+            accumulator.add("t3", 2, 10, DAY)
+            await accumulator.flush(db_pool)
+            daily = await db_pool.fetch("SELECT user_id, day, tokens_used, jobs FROM user_daily_tokens")
+            return await written_activity(db_pool), {(row["user_id"], row["day"]): (row["tokens_used"], row["jobs"])
+                                                     for row in daily}
+
+    activity, daily_tokens = asyncio.run(scenario())
+    assert activity == {"t1": (1, 100), "t2": (1, 50), "t3": (2, 10)}
+    assert daily_tokens == {(1, DAY.date()): (150, 2), (2, DAY.date()): (10, 1)}
+
+
+def test_refused_rows_are_dropped_without_blocking_the_batch(database):
+    accumulator = ActivityAccumulator(flush_interval=0.01)
+
+    async def scenario():
+        async with database.pool() as db_pool:
+            await add_users(db_pool, 1)
+            flusher = asyncio.create_task(accumulator.run(db_pool))
+            # user 9 was deleted
+            await asyncio.wait_for(accumulator.write([("t1", 1, 100, DAY), ("t2", 9, 50, DAY), ("t3", 1, 10, DAY)]), 5)
+            flusher.cancel()
+            await asyncio.gather(flusher, return_exceptions=True)
+            return await written_activity(db_pool)
+
+    assert set(asyncio.run(scenario())) == {"t1", "t3"}
+    assert accumulator._pending == []
+
+
+def test_unavailable_database_fails_writers_and_retries_added_rows():
+    database = UnavailableDatabase()
+    accumulator = ActivityAccumulator(max_attempts=2)
+
+    async def scenario():
+        accumulator.add("t1", 1, 100, DAY)
+        waiting = asyncio.ensure_future(accumulator.write([("t2", 1, 50, DAY)]))
+        await asyncio.sleep(0)
+        with pytest.raises(ConnectionRefusedError):
+            await accumulator.flush(database)
+        with pytest.raises(ConnectionRefusedError):
+            await waiting
+        assert [row[0] for row, _, _ in accumulator._pending] == ["t1"]
+        # Dropped after max_attempts
+        with pytest.raises(ConnectionRefusedError):
+            await accumulator.flush(database)
+        assert accumulator._pending == []
+
+    asyncio.run(scenario())
+
+
+def test_buffer_is_bounded():
+    accumulator = ActivityAccumulator(max_pending=2)
+    for index in range(5):
+        accumulator.add(f"t{index}", 1, 1, DAY)
+    assert len(accumulator._pending) == 2
+
+
+def test_cancelled_flush_keeps_the_rows(database):
+    accumulator = ActivityAccumulator()
+
+    async def scenario():
+        async with database.pool() as db_pool:
+            await add_users(db_pool, 1)
+            accumulator.add("t1", 1, 100, DAY)
+            flush = asyncio.create_task(accumulator.flush(HangingDatabase()))
+            await asyncio.sleep(0)
+            flush.cancel()
+            await asyncio.gather(flush, return_exceptions=True)
+            await accumulator.flush(db_pool)
+            return await written_activity(db_pool)
+
+    assert asyncio.run(scenario()) == {"t1": (1, 100)}
@@ -0,0 +1,22 @@
+from src.study_buddy.call_cache import CallCache, LocalBackend
+
+
+def test_results_are_cached():
+    cache = CallCache("test", ttl=60, backend=LocalBackend())
+    calls = []
+    call = lambda: calls.append(1) or {"organic": ["result"]}
+    assert cache.get_or_call("key", call) == {"organic": ["result"]}
+    assert cache.get_or_call("key", call) == {"organic": ["result"]}
+    assert len(calls) == 1
+
+
+def test_errors_reported_as_results_are_not_cached():
+    cache = CallCache("test", ttl=60, backend=LocalBackend())
+    answers = [{"message": "Not enough credits", "statusCode": 400}, {"organic": ["result"]}]
+    call = lambda: answers.pop(0)
+    is_result = lambda result: "organic" in result
+
+    assert cache.get_or_call("key", call, cacheable=is_result) == {"message": "Not enough credits", "statusCode": 400}
+    assert cache.get_or_call("key", call, cacheable=is_result) == {"organic": ["result"]}
+    assert cache.get_or_call("key", call, cacheable=is_result) == {"organic": ["result"]}
+    assert answers == []
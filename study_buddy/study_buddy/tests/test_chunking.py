@@ -0,0 +1,49 @@
+import pytest
+
+pytest.importorskip("PyPDF2")
+
+from src.study_buddy.tools.chunking import _split_oversized, chunk_pages, Chunk, ChunkSummarizer, CHARS_PER_TOKEN
+from src.study_buddy.tools.pdf_extraction import join_pages
+
+
+def test_split_oversized_keeps_the_reading_order():
+    text = "AAAA\n\n" + "B" * 30 + "\n\nCC"
+    parts = _split_oversized(text, 3)
+    assert parts == ["AAAA", "B" * 12, "B" * 12, "B" * 6 + "\n\nCC"]
+    assert "".join(parts).replace("\n\n", "") == text.replace("\n\n", "")
+
+
+def test_split_oversized_respects_the_budget():
+    text = "\n\n".join(["x" * 5, "y" * 25, "z" * 7, "w" * 3])
+    assert all(len(part) <= 3 * CHARS_PER_TOKEN for part in _split_oversized(text, 3))
+
+
+def test_chunk_pages_groups_pages_under_the_budget():
+    pages = ["a" * 36, "b" * 36, "c" * 36, "d" * 100]
+    chunks = chunk_pages(join_pages(pages), budget=20)
+    assert [chunk.label for chunk in chunks] == ["pages 1-2", "page 3", "page 4 (1)", "page 4 (2)"]
+    assert chunks[0].text == "a" * 36 + "\n" + "b" * 36
+
+
+class CountingLLM:
+    model = "test"
+
+    def __init__(self):
+        self.calls = 0
+
+    def call(self, messages):
+        self.calls += 1
+        return "s" * 100
+
+
+def test_chunk_summaries_are_cached_within_the_cap(tmp_path):
+    llm = CountingLLM()
+    summarizer = ChunkSummarizer(llm, cache_dir=str(tmp_path), cache_max_bytes=250)
+    chunks = [Chunk(label=f"page {index}", text=f"text {index}") for index in range(5)]
+    for chunk in chunks:
+        summarizer.summarize_chunk(chunk)
+    assert sum(entry.stat().st_size for entry in tmp_path.iterdir()) <= 250
+
+    llm.calls = 0
+    summarizer.summarize_chunk(chunks[-1])
+    assert llm.calls == 0
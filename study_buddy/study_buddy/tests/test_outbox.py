@@ -0,0 +1,128 @@
+import asyncio
+import fakeredis
+import fakeredis.aioredis
+import pytest
+from src import outbox
+from src.outbox import StreamConsumer, ActivityIngester, publish_task_result, decode_entry
+
+STREAM = "outbox:test"
+
+
+class RecordingConsumer(StreamConsumer):
+    def __init__(self, fail=False, **kwargs):
+        super().__init__(group="test", stream=STREAM, block_ms=10, **kwargs)
+        self.fail = fail
+        self.batches = []
+
+    async def handle(self, entries):
+        if self.fail:
+            raise RuntimeError("handler down")
+        self.batches.append([entry["task_id"] for entry in entries])
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def test_stream_consumer_is_abstract():
+    with pytest.raises(TypeError):
+        StreamConsumer(group="test")
+
+
+def test_publish_only_keeps_the_outcome(server, monkeypatch):
+    redis_client = fakeredis.FakeRedis(server=server)
+    monkeypatch.setattr(outbox, "get_sync_redis_client", lambda: redis_client)
+    monkeypatch.setattr(outbox, "OUTBOX_STREAM", STREAM)
+    publish_task_result("t1", {"user_id": 3, "metadata": 120, "result": {"explanation": "x" * 10000}})
+    publish_task_result("t2", {"error": "boom"})
+
+    (id1, fields1), (id2, fields2) = redis_client.xrange(STREAM)
+    assert fields1 == {b"task_id": b"t1", b"user_id": b"3", b"tokens_used": b"120"}
+    assert decode_entry(id2, fields2)["error"] == "boom"
+
+
+def test_entries_are_acknowledged_once_handled(server):
+    async def scenario():
+        redis_client = fakeredis.aioredis.FakeRedis(server=server)
+        for task_id in ("t1", "t2"):
+            await redis_client.xadd(STREAM, {"task_id": task_id})
+        consumer = RecordingConsumer(consumer="c1", redis_client=redis_client)
+        await consumer.ensure_group()
+        assert await consumer.consume_once() == 2
+        assert consumer.batches == [["t1", "t2"]]
+        assert (await redis_client.xpending(STREAM, "test"))["pending"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_failed_batches_are_reclaimed_by_another_consumer(server):
+    async def scenario():
+        redis_client = fakeredis.aioredis.FakeRedis(server=server)
+        await redis_client.xadd(STREAM, {"task_id": "t1"})
+        failing = RecordingConsumer(fail=True, consumer="c1", redis_client=redis_client)
+        await failing.ensure_group()
+        with pytest.raises(RuntimeError):
+            await failing.consume_once()
+        assert (await redis_client.xpending(STREAM, "test"))["pending"] == 1
+
+        # Claimed with XAUTOCLAIM once idle for claim_idle_ms
+        recovering = RecordingConsumer(consumer="c2", redis_client=redis_client, claim_idle_ms=0)
+        assert await recovering.consume_once() == 1
+        assert recovering.batches == [["t1"]]
+        assert (await redis_client.xpending(STREAM, "test"))["pending"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_ingester_writes_the_rows_of_successful_tasks(server, monkeypatch):
+    written = []
+
+    async def write(rows):
+        written.extend(rows)
+
+    monkeypatch.setattr(outbox.activity_accumulator, "write", write)
+
+    async def scenario():
+        redis_client = fakeredis.aioredis.FakeRedis(server=server)
+        await redis_client.xadd(STREAM, {"task_id": "t1", "user_id": "3", "tokens_used": "120"})
+        await redis_client.xadd(STREAM, {"task_id": "t2", "error": "boom"})
+        ingester = ActivityIngester(stream=STREAM, redis_client=redis_client, block_ms=10)
+        await ingester.ensure_group()
+        assert await ingester.consume_once() == 2
+
+    asyncio.run(scenario())
+    assert [row[:3] for row in written] == [("t1", 3, 120)]
+
+
+def test_malformed_entries_are_isolated_then_dead_lettered(server, monkeypatch):
+    written = []
+
+    async def write(rows):
+        written.extend(row[:3] for row in rows)
+
+    monkeypatch.setattr(outbox.activity_accumulator, "write", write)
+
+    async def scenario():
+        redis_client = fakeredis.aioredis.FakeRedis(server=server)
+        await redis_client.xadd(STREAM, {"task_id": "t1", "user_id": "3", "tokens_used": "120"})
+        await redis_client.xadd(STREAM, {"task_id": "bad", "user_id": "3", "tokens_used": "lots"})
+        await redis_client.xadd(STREAM, {"task_id": "t2", "user_id": "4", "tokens_used": "7"})
+        ingester = ActivityIngester(stream=STREAM, redis_client=redis_client, block_ms=10, claim_idle_ms=0,
+                                    max_deliveries=3)
+        await ingester.ensure_group()
+
+        # The healthy entries are written and acknowledged, the malformed one stays pending
+        assert await ingester.consume_once() == 2
+        assert written == [("t1", 3, 120), ("t2", 4, 7)]
+        assert (await redis_client.xpending(STREAM, "activity_ingester"))["pending"] == 1
+
+        # Delivered again until max_deliveries, then moved to the dead-letter stream
+        assert await ingester.consume_once() == 0
+        assert await ingester.consume_once() == 1
+        assert (await redis_client.xpending(STREAM, "activity_ingester"))["pending"] == 0
+        (_, fields), = await redis_client.xrange(f"{STREAM}:dead")
+        assert fields[b"task_id"] == b"bad" and b"dead_letter_error" in fields
+
+    asyncio.run(scenario())
+    assert len(written) == 2
@@ -0,0 +1,39 @@
+import asyncio
+import threading
+import pytest
+from fastapi import HTTPException
+from src.passwords import PasswordHashingPool
+
+
+def test_cancelled_request_keeps_its_slot_until_the_job_is_done():
+    pool = PasswordHashingPool(workers=1, max_queue=0)
+    started, release = threading.Event(), threading.Event()
+
+    def slow_hash():
+        started.set()
+        release.wait(5)
+        return "hash"
+
+    async def scenario():
+        request = asyncio.create_task(pool.run(slow_hash))
+        await asyncio.to_thread(started.wait, 5)
+        # The client disconnected, the bcrypt job keeps running in the executor
+        request.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await request
+        with pytest.raises(HTTPException) as rejected:
+            await pool.run(lambda: "hash")
+        assert rejected.value.status_code == 503
+
+        release.set()
+        for _ in range(100):
+            if pool._in_flight == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert await pool.run(lambda: "hash") == "hash"
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        release.set()
+        pool.shutdown()
@@ -0,0 +1,55 @@
+import os
+import threading
+import time
+import pytest
+
+pytest.importorskip("PyPDF2")
+
+from src.study_buddy.tools import pdf_extraction
+from src.study_buddy.tools.pdf_extraction import evict_cache_entries, read_json_cache, write_json_cache
+
+
+def write_entry(directory, name, size, age):
+    path = directory / name
+    path.write_text('"' + "x" * (size - 2) + '"')
+    os.utime(path, (time.time() - age, time.time() - age))
+    return path
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    oldest = write_entry(tmp_path, "a.json", 40, age=30)
+    read = write_entry(tmp_path, "b.json", 40, age=20)
+    write_entry(tmp_path, "c.json", 40, age=10)
+    # A hit refreshes the entry
+    read_json_cache(str(read))
+
+    write_json_cache(str(tmp_path / "d.json"), "y" * 28, max_bytes=80)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["b.json", "d.json"]
+    assert not oldest.exists()
+
+
+def test_stale_partial_writes_are_dropped(tmp_path):
+    write_entry(tmp_path, "a.json.1.2.tmp", 10, age=2 * pdf_extraction.STALE_TMP_SECONDS)
+    writing = write_entry(tmp_path, "b.json.1.3.tmp", 10, age=0)
+    evict_cache_entries(str(tmp_path), 1000)
+    assert list(tmp_path.iterdir()) == [writing]
+
+
+def test_concurrent_extractions_of_a_file_run_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_extraction, "PDF_TEXT_CACHE_DIR", str(tmp_path))
+    calls = []
+
+    def extract_pages(path):
+        calls.append(path)
+        time.sleep(0.05)
+        return ["page"]
+
+    monkeypatch.setattr(pdf_extraction, "extract_pages", extract_pages)
+    threads = [threading.Thread(target=pdf_extraction.extract_text, args=("material.pdf", "f" * 64))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == ["material.pdf"]
+    assert pdf_extraction._extraction_locks == {}
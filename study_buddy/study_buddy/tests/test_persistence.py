@@ -0,0 +1,159 @@
+import asyncio
+import json
+import fakeredis.aioredis
+import pytest
+from src.persistence import ResultPersistence, RECENCY_ORDER, create_events_index
+from src.result_cache import DIRTY_USERS_KEY, RECENCY_FLOOR, link_user_result, result_key, user_key, recency_key
+
+
+class UnavailableDatabase:
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        raise ConnectionRefusedError("database down")
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+def run(database, scenario):
+    """
+    Run `scenario(db_pool, redis_client)` with users 1 and 2.
+    """
+    async def main():
+        async with database.pool() as db_pool:
+            await db_pool.executemany("INSERT INTO users (id, username, hashed_password) VALUES ($1, $2, 'x')",
+                                      [(1, "user1"), (2, "user2")])
+            return await scenario(db_pool, fakeredis.aioredis.FakeRedis())
+
+    return asyncio.run(main())
+
+
+async def insert_event(db_pool, user_id, filename, result, last_accessed=None):
+    await db_pool.execute("INSERT INTO events (user_id, filename, result, last_accessed) VALUES ($1, $2, $3, $4)",
+                          user_id, filename, result, last_accessed)
+
+
+async def ranked(db_pool, user_id):
+    rows = await db_pool.fetch(f"SELECT filename FROM events WHERE user_id = $1 ORDER BY {RECENCY_ORDER}", user_id)
+    return [row["filename"] for row in rows]
+
+
+def test_sync_writes_the_dirty_users_with_their_access_times(database):
+    async def scenario(db_pool, redis_client):
+        await link_user_result(redis_client, 1, "a", value='{"summary": "a"}', accessed_at=10)
+        await link_user_result(redis_client, 2, "b", value='{"summary": "b"}', accessed_at=20)
+        await insert_event(db_pool, 1, "evicted", "{}", 5)
+
+        assert await ResultPersistence(batch_size=1).sync(db_pool, redis_client) == 2
+        assert await redis_client.scard(DIRTY_USERS_KEY) == 0
+        return await db_pool.fetch("SELECT user_id, filename, result::text AS result, last_accessed FROM events")
+
+    rows = run(database, scenario)
+    assert {(row["user_id"], row["filename"]): (json.loads(row["result"]), row["last_accessed"]) for row in rows} == {
+        (1, "a"): ({"summary": "a"}, 10),
+        (2, "b"): ({"summary": "b"}, 20),
+    }
+
+
+def test_sync_updates_the_rows_in_place(database):
+    async def scenario(db_pool, redis_client):
+        await link_user_result(redis_client, 1, "a", value='{"summary": "old"}', accessed_at=10)
+        await ResultPersistence().sync(db_pool, redis_client)
+        await link_user_result(redis_client, 1, "a", value='{"summary": "new"}', accessed_at=20)
+        await ResultPersistence().sync(db_pool, redis_client)
+        return await db_pool.fetch("SELECT result::text AS result, last_accessed FROM events")
+
+    rows = run(database, scenario)
+    assert [(json.loads(row["result"]), row["last_accessed"]) for row in rows] == [({"summary": "new"}, 20)]
+
+
+def test_trim_keeps_the_most_recently_accessed(database):
+    async def scenario(db_pool, redis_client):
+        await link_user_result(redis_client, 1, "read_often", value="{}", accessed_at=10)
+        await link_user_result(redis_client, 1, "stale", value="{}", accessed_at=20)
+        await link_user_result(redis_client, 1, "new", value="{}", accessed_at=30)
+        # Reading the first file makes it the most recent, although it was inserted first
+        await redis_client.zadd(recency_key(1), {"read_often": 40}, xx=True)
+
+        await ResultPersistence(keep=2).sync(db_pool, redis_client)
+        return await ranked(db_pool, 1)
+
+    assert run(database, scenario) == ["read_often", "new"]
+
+
+def test_files_never_accessed_are_stored_without_access_time(database):
+    async def scenario(db_pool, redis_client):
+        await redis_client.hset(user_key(1), "legacy", "{}")
+        await link_user_result(redis_client, 1, "a", value="{}", accessed_at=10)
+        assert await redis_client.zscore(recency_key(1), "legacy") == RECENCY_FLOOR
+
+        await ResultPersistence().sync(db_pool, redis_client)
+        assert await db_pool.fetchval("SELECT last_accessed FROM events WHERE filename = 'legacy'") is None
+        return await ranked(db_pool, 1)
+
+    assert run(database, scenario) == ["a", "legacy"]
+
+
+def test_failed_sync_keeps_the_users_dirty():
+    async def scenario():
+        redis_client = fakeredis.aioredis.FakeRedis()
+        await link_user_result(redis_client, 1, "a", value="{}", accessed_at=10)
+        with pytest.raises(ConnectionRefusedError):
+            await ResultPersistence().sync(UnavailableDatabase(), redis_client)
+        assert await redis_client.smembers(DIRTY_USERS_KEY) == {b"1"}
+
+    asyncio.run(scenario())
+
+
+def test_warm_up_restores_the_shared_entries_and_the_access_times(database):
+    async def scenario(db_pool, redis_client):
+        await insert_event(db_pool, 1, "unknown", '{"summary": "unknown"}')
+        await insert_event(db_pool, 1, "recent", '{"summary": "recent"}', 30)
+        await insert_event(db_pool, 1, "older", "{}", 5)
+        await insert_event(db_pool, 2, "older", "{}", 8)
+        # Linked since the sync, and recomputed: both kept as is
+        await redis_client.set(result_key("recent"), '{"summary": "newer"}')
+        await link_user_result(redis_client, 1, "recent", accessed_at=50)
+
+        assert await ResultPersistence(keep=3).warm_up(db_pool, redis_client) == 4
+        assert await redis_client.zrange(recency_key(1), 0, -1, withscores=True) == [
+            (b"unknown", RECENCY_FLOOR), (b"older", 5), (b"recent", 50)]
+        assert await redis_client.zscore(recency_key(2), "older") == 8
+        # The users point to a single shared entry per file
+        assert await redis_client.hget(user_key(2), "older") == result_key("older").encode()
+        assert await redis_client.get(result_key("unknown")) == b'{"summary": "unknown"}'
+        assert await redis_client.get(result_key("recent")) == b'{"summary": "newer"}'
+        assert await redis_client.ttl(result_key("older")) > 0
+
+    run(database, scenario)
+
+
+def test_warm_up_loads_the_most_recently_accessed(database):
+    async def scenario(db_pool, redis_client):
+        await insert_event(db_pool, 2, "unknown", "{}")
+        await insert_event(db_pool, 2, "older", "{}", 1)
+        await insert_event(db_pool, 2, "recent", "{}", 2)
+
+        assert await ResultPersistence(keep=2).warm_up(db_pool, redis_client) == 2
+        return sorted(await redis_client.hkeys(user_key(2)))
+
+    assert run(database, scenario) == [b"older", b"recent"]
+
+
+def test_events_index_is_created_once(database):
+    async def scenario(db_pool, redis_client):
+        await db_pool.execute("DROP INDEX events_user_filename")
+        await insert_event(db_pool, 1, "a", '{"summary": "first"}')
+        await insert_event(db_pool, 1, "a", '{"summary": "latest"}')
+
+        async def create():
+            async with db_pool.acquire() as conn:
+                await create_events_index(conn)
+
+        # Instances starting together
+        await asyncio.gather(create(), create(), create())
+        return await db_pool.fetch("SELECT result::text AS result FROM events")
+
+    assert [json.loads(row["result"]) for row in run(database, scenario)] == [{"summary": "latest"}]
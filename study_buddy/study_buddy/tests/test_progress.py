@@ -0,0 +1,52 @@
+import asyncio
+import json
+import fakeredis.aioredis
+from src.progress import ProgressHub, progress_key, publish_progress, stream_progress
+
+
+async def collect(stream):
+    return [message async for message in stream]
+
+
+def test_stream_ends_on_a_terminal_stage_the_hub_missed():
+    async def scenario():
+        redis_client = fakeredis.aioredis.FakeRedis()
+        await publish_progress(redis_client, "t1", "explaining")
+        # The hub is not subscribed: the stage is only found by re-reading it
+        stream = asyncio.create_task(collect(stream_progress(redis_client, "t1", hub=ProgressHub(), heartbeat=0.05)))
+        await asyncio.sleep(0.1)
+        await redis_client.set(progress_key("t1"), json.dumps({"task_id": "t1", "stage": "done"}))
+        return await asyncio.wait_for(stream, timeout=1)
+
+    messages = asyncio.run(scenario())
+    stages = [json.loads(message.split("data: ")[1])["stage"] for message in messages
+              if message.startswith("event: progress")]
+    assert stages == ["explaining", "done"]
+
+
+def test_stream_of_an_unknown_task_is_closed_after_its_max_duration():
+    async def scenario():
+        redis_client = fakeredis.aioredis.FakeRedis()
+        return await asyncio.wait_for(
+            collect(stream_progress(redis_client, "unknown", hub=ProgressHub(), heartbeat=0.05, max_duration=0.2)),
+            timeout=1)
+
+    messages = asyncio.run(scenario())
+    assert ": keep-alive\n\n" in messages
+    assert messages[-1].startswith("event: timeout")
+
+
+def test_hub_asks_the_streams_to_reread_once_subscribed():
+    async def scenario():
+        redis_client = fakeredis.aioredis.FakeRedis()
+        hub = ProgressHub()
+        async with hub.subscribe("t1") as events:
+            hub.start(redis_client)
+            try:
+                assert await asyncio.wait_for(events.get(), timeout=1) is None
+                await publish_progress(redis_client, "t1", "done")
+                assert (await asyncio.wait_for(events.get(), timeout=1))["stage"] == "done"
+            finally:
+                await hub.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,67 @@
+import asyncio
+import fakeredis.aioredis
+import pytest
+from src import result_cache
+from src.result_cache import (DIRTY_USERS_KEY, RECENCY_FLOOR, link_user_result, get_user_result,
+                              get_recent_user_results, user_key, recency_key, result_key)
+
+
+@pytest.fixture(autouse=True)
+def cache_size(monkeypatch):
+    monkeypatch.setattr(result_cache, "CACHE_SIZE", 3)
+
+
+def run(scenario):
+    return asyncio.run(scenario(fakeredis.aioredis.FakeRedis()))
+
+
+def test_link_evicts_the_least_recently_accessed():
+    async def scenario(redis_client):
+        for accessed_at, file_id in enumerate(["a", "b", "c"], start=1):
+            assert await link_user_result(redis_client, 7, file_id, accessed_at=accessed_at) == []
+        await redis_client.zadd(recency_key(7), {"a": 10}, xx=True)
+
+        assert await link_user_result(redis_client, 7, "d", accessed_at=11) == ["b"]
+        assert sorted(await redis_client.hkeys(user_key(7))) == [b"a", b"c", b"d"]
+        assert await redis_client.zrange(recency_key(7), 0, -1) == [b"c", b"a", b"d"]
+        assert await redis_client.hget(user_key(7), "d") == result_key("d").encode()
+        assert await redis_client.smembers(DIRTY_USERS_KEY) == {b"7"}
+
+    run(scenario)
+
+
+def test_results_linked_before_the_index_are_evicted_first():
+    async def scenario(redis_client):
+        await redis_client.hset(user_key(7), mapping={"legacy1": "{}", "legacy2": "{}"})
+        await link_user_result(redis_client, 7, "a", accessed_at=1)
+
+        assert await redis_client.zscore(recency_key(7), "legacy1") == RECENCY_FLOOR
+        evicted = await link_user_result(redis_client, 7, "b", accessed_at=2)
+        assert evicted in (["legacy1"], ["legacy2"])
+        assert await redis_client.zcard(recency_key(7)) == await redis_client.hlen(user_key(7)) == 3
+
+    run(scenario)
+
+
+def test_unindexed_results_rank_at_the_floor():
+    async def scenario(redis_client):
+        await link_user_result(redis_client, 7, "a", accessed_at=1)
+        await redis_client.hset(user_key(7), "legacy", '{"summary": "s"}')
+
+        page = await get_recent_user_results(redis_client, 7)
+        assert [item["file_id"] for item in page["items"]] == ["a", "legacy"]
+        assert page["items"][1]["last_accessed"] == RECENCY_FLOOR
+
+    run(scenario)
+
+
+def test_reading_a_result_counts_as_an_access():
+    async def scenario(redis_client):
+        await link_user_result(redis_client, 7, "a", value='{"summary": "a"}', accessed_at=1)
+        await link_user_result(redis_client, 7, "b", accessed_at=2)
+        await link_user_result(redis_client, 7, "c", accessed_at=3)
+
+        assert await get_user_result(redis_client, 7, "a") == {"summary": "a"}
+        assert await link_user_result(redis_client, 7, "d") == ["b"]
+
+    run(scenario)
@@ -0,0 +1,54 @@
+import asyncio
+from src import security
+
+
+class SlowPool:
+    """
+    Pool whose query answers "no such user" once released by the test.
+    """
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.queries = 0
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def fetchrow(self, query, username):
+        self.queries += 1
+        await self.release.wait()
+        return None
+
+
+def test_lookup_started_before_an_invalidation_is_not_cached():
+    async def scenario():
+        pool = SlowPool()
+        lookup = asyncio.ensure_future(security.get_cached_user(pool, "alice"))
+        await asyncio.sleep(0)
+        # alice registers while the lookup is running
+        security.invalidate_user("alice")
+        pool.release.set()
+        assert await lookup is None
+        assert "alice" not in security.unknown_users_cache
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_misses_share_one_query():
+    async def scenario():
+        pool = SlowPool()
+        lookups = [asyncio.ensure_future(security.get_cached_user(pool, "bob")) for _ in range(3)]
+        await asyncio.sleep(0)
+        pool.release.set()
+        assert await asyncio.gather(*lookups) == [None, None, None]
+        assert pool.queries == 1
+        assert "bob" in security.unknown_users_cache
+        assert "bob" not in security.pending_user_lookups
+
+    asyncio.run(scenario())
@@ -0,0 +1,56 @@
+import io
+import fakeredis
+import pytest
+from src.spool import UploadSpool, SpoolFullError
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return UploadSpool(tmp_path, quota=100, redis_client=fakeredis.FakeRedis())
+
+
+def test_store_writes_once_and_counts_references(spool):
+    path = spool.store(io.BytesIO(b"a" * 40), "h1", 40)
+    assert spool.store(io.BytesIO(b"a" * 40), "h1", 40) == path
+    assert path.read_bytes() == b"a" * 40
+    assert spool.refcount("h1") == 2
+
+    spool.release("h1")
+    assert path.exists()
+    spool.release("h1")
+    assert not path.exists()
+
+
+def test_reservations_count_in_the_usage(spool):
+    # An upload of another process is being written
+    spool.redis.zadd("spool:reserved", {"other:60": 9e12})
+    assert spool.usage() == 60
+
+    with pytest.raises(SpoolFullError):
+        spool.store(io.BytesIO(b"a" * 50), "h1", 50)
+    assert spool.refcount("h1") == 0
+
+
+def test_reservation_is_dropped_once_written(spool):
+    spool.store(io.BytesIO(b"a" * 50), "h1", 50)
+    assert spool.redis.zcard("spool:reserved") == 0
+    assert spool.usage() == 50
+
+
+def test_expired_reservations_are_ignored(spool):
+    spool.redis.zadd("spool:reserved", {"dead:60": 1})
+    assert spool.usage() == 0
+
+
+
+class FailingStream(io.BytesIO):
+    def read(self, *args):
+        raise OSError(28, "No space left on device")
+
+
+def test_failed_write_drops_the_reference_and_the_partial_file(spool):
+    with pytest.raises(OSError):
+        spool.store(FailingStream(), "h1", 40)
+    assert spool.refcount("h1") == 0
+    assert spool.redis.zcard("spool:reserved") == 0
+    assert list(spool.directory.iterdir()) == []
@@ -0,0 +1,24 @@
+import os
+import pytest
+
+pytest.importorskip("PyPDF2")
+
+from src.study_buddy.tools import vector_index
+from src.study_buddy.tools.pdf_extraction import join_pages
+from src.study_buddy.tools.vector_index import MaterialIndexes, HashingEmbedder
+
+
+def test_least_recently_used_indexes_are_evicted_from_the_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_index, "extract_text",
+                        lambda path, file_hash: join_pages([f"cours {file_hash} " * 20, "exercices " * 20]))
+    probe = MaterialIndexes(HashingEmbedder(64), index_dir=str(tmp_path / "probe"))
+    probe.get("a.pdf", "a")
+    index_size = sum(entry.stat().st_size for entry in (tmp_path / "probe").iterdir())
+
+    indexes = MaterialIndexes(HashingEmbedder(64), index_dir=str(tmp_path / "indexes"), max_loaded=1,
+                              max_bytes=2 * index_size + index_size // 2)
+    for file_hash in ("a", "b", "c"):
+        indexes.get(f"{file_hash}.pdf", file_hash)
+    assert len(os.listdir(tmp_path / "indexes")) == 2
+    assert not os.path.exists(indexes._index_path("a"))
+    assert "exercices" in indexes.search("c.pdf", "exercices", k=1, file_hash="c")[0][1]